@@ -1,16 +1,18 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR
 from django.utils.safestring import mark_safe
 import json
 from reversion.admin import VersionAdmin
-from waherb.utils import ModelDescMixin, ActiveAdminMixin, WALeafletGeoAdmin
+from waherb.utils import ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, LargeTableChangeList, WALeafletGeoAdmin
 from .models import (
     Attachment, Annotation, Transaction, Organisation, Person, Address, Project, Permit,
     Location, CollectingEvent, Designation, Specimen, TexpressData,
 )
+from .search import search_texpress_query
 
 
 @admin.register(Attachment)
-class AttachmentAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class AttachmentAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('upload', 'modified', 'modifier')
     list_filter = ('type',)
@@ -19,7 +21,7 @@ class AttachmentAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Annotation)
-class AnnotationAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class AnnotationAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('type', 'annotation', 'modified', 'modifier')
     list_filter = ('type',)
@@ -28,7 +30,7 @@ class AnnotationAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Transaction)
-class TransactionAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class TransactionAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('type', 'description', 'modified', 'modifier')
     list_filter = ('type',)
@@ -37,7 +39,7 @@ class TransactionAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Address)
-class AddressAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class AddressAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('address_line_1', 'suburb', 'state', 'modified', 'modifier')
     readonly_fields = ('metadata',)
@@ -47,7 +49,7 @@ class AddressAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Organisation)
-class OrganisationAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class OrganisationAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('name', 'email', 'modified', 'modifier')
     readonly_fields = ('metadata',)
@@ -55,7 +57,7 @@ class OrganisationAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Person)
-class PersonAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class PersonAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('name', 'type', 'email', 'modified', 'modifier')
     list_filter = ('type',)
@@ -65,7 +67,7 @@ class PersonAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Project)
-class ProjectAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class ProjectAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('name', 'modified', 'modifier')
     readonly_fields = ('metadata',)
@@ -73,7 +75,7 @@ class ProjectAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Permit)
-class PermitAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class PermitAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('permit_no', 'modified', 'modifier')
     readonly_fields = ('metadata',)
@@ -81,7 +83,7 @@ class PermitAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Location)
-class LocationAdmin(ModelDescMixin, ActiveAdminMixin, WALeafletGeoAdmin, VersionAdmin):
+class LocationAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, WALeafletGeoAdmin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('description', 'spatial_accuracy', 'modifier')
     list_filter = ('spatial_accuracy',)
@@ -93,7 +95,7 @@ class LocationAdmin(ModelDescMixin, ActiveAdminMixin, WALeafletGeoAdmin, Version
 
 
 @admin.register(CollectingEvent)
-class CollectingEventAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class CollectingEventAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     date_hierarchy = 'date'
     list_display = ('person', 'project', 'permit', 'date', 'modified', 'modifier')
@@ -103,7 +105,7 @@ class CollectingEventAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Specimen)
-class SpecimenAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class SpecimenAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     list_display = ('barcode', 'event', 'collection', 'linear_sequence', 'modified', 'modifier')
     readonly_fields = ('metadata',)
@@ -111,7 +113,7 @@ class SpecimenAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Designation)
-class DesignationAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class DesignationAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     exclude = ('created', 'creator', 'modified', 'modifier', 'effective_to')
     date_hierarchy = 'date'
     list_display = ('person', 'name', 'specimen', 'date', 'modified', 'modifier')
@@ -120,12 +122,20 @@ class DesignationAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
     search_fields = ('person__name', 'name__name', 'specimen__barcode')
 
 
+class TexpressDataChangeList(LargeTableChangeList):
+
+    def get_ordering(self, request, queryset):
+        # Order search results by relevance, unless the user has explicitly sorted the list.
+        if 'rank' in queryset.query.annotations and ORDER_VAR not in self.params:
+            return ['-rank', '-pk']
+        return super().get_ordering(request, queryset)
+
+
 @admin.register(TexpressData)
-class TexpressDataAdmin(admin.ModelAdmin):
+class TexpressDataAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     fields = ('row_pre',)
     readonly_fields = ('row_pre',)
     search_fields = ('row_text',)
-    show_full_result_count = False
     save_on_top = True
 
     def row_pre(self, obj):
@@ -136,15 +146,17 @@ class TexpressDataAdmin(admin.ModelAdmin):
         # No one gets to delete these records (they're RO archives).
         return False
 
+    def get_queryset(self, request):
+        # The text search columns are large and aren't displayed, so don't load them.
+        return super().get_queryset(request).defer('row_text', 'row_tsv')
+
+    def get_changelist(self, request, **kwargs):
+        return TexpressDataChangeList
+
     def get_search_results(self, request, queryset, search_term):
-        print(search_term)
-        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
-        # The default query that the ORM generates for this is pretty slow.
-        # For performance, run a raw query over the indexed row_text column using the search term.
-        # Then, use the list of PKs from that the filter the queryset.
+        # The default icontains query over row_text can't use an index, so instead use the
+        # Texpress query syntax: key-scoped terms (key:value) use the GIN index on row, and
+        # free text terms run a ranked full-text search over the indexed row_tsv column.
         if search_term:
-            search_term = search_term.replace('": "', '":"')  # Just in case someone still adds a space between key & value.
-            raw_qs = TexpressData.objects.raw("SELECT * FROM herbarium_texpressdata WHERE row_text ILIKE '%%{}%%'".format(search_term))
-            pks = [i.pk for i in raw_qs]
-            queryset = queryset.filter(pk__in=pks)
-        return queryset, use_distinct
+            return search_texpress_query(search_term, queryset), False
+        return queryset, False
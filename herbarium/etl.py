@@ -0,0 +1,269 @@
+from datetime import datetime
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+from multiprocessing import Pool
+from nomenclature.models import Name
+from time import perf_counter
+from .models import (
+    TexpressData, Person, Project, Permit, Location, CollectingEvent, Specimen, Designation,
+)
+
+
+# The Texpress row keys used to populate each of the normalised fields.
+# Adjust these if the archive export uses different key names.
+TEXPRESS_KEYS = {
+    'barcode': 'sheetno',
+    'collection': 'collection',
+    'linear_sequence': 'linseq',
+    'collector': 'collector',
+    'project': 'project',
+    'permit': 'permitno',
+    'date': 'colldate',
+    'locality': 'locality',
+    'latitude': 'lat',
+    'longitude': 'long',
+    'altitude': 'alt',
+    'name': 'name',
+    'determiner': 'detby',
+    'det_date': 'detdate',
+}
+
+# Date formats found in Texpress rows, with the temporal accuracy each implies.
+TEXPRESS_DATE_FORMATS = (
+    ('%Y-%m-%d', 'Day'),
+    ('%d/%m/%Y', 'Day'),
+    ('%d.%m.%Y', 'Day'),
+    ('%m/%Y', 'Month'),
+    ('%Y-%m', 'Month'),
+    ('%Y', 'Year'),
+)
+
+
+# The maximum length of each normalised field which is stored in a length-limited column.
+FIELD_MAX_LENGTHS = {
+    'barcode': Specimen._meta.get_field('barcode').max_length,
+    'collection': Specimen._meta.get_field('collection').max_length,
+    'linear_sequence': Specimen._meta.get_field('linear_sequence').max_length,
+    'collector': Person._meta.get_field('name').max_length,
+    'determiner': Person._meta.get_field('name').max_length,
+    'project': Project._meta.get_field('name').max_length,
+    'permit': Permit._meta.get_field('permit_no').max_length,
+}
+
+
+def _value(row, field):
+    """Returns the stripped string value of a field in a Texpress row, or None.
+    List values (unsanitised rows) are joined into a single string.
+    """
+    value = row.get(TEXPRESS_KEYS[field])
+    if isinstance(value, list):
+        value = ' '.join([str(i) for i in value if i])
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _date(value):
+    """Parse a Texpress date string, returning a tuple of (date, temporal accuracy).
+    """
+    if value:
+        for fmt, accuracy in TEXPRESS_DATE_FORMATS:
+            try:
+                return datetime.strptime(value, fmt).date(), accuracy
+            except ValueError:
+                continue
+    return None, None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _transform_range(bounds):
+    """Worker function: read the TexpressData rows with lo <= pk < hi and return a tuple of
+    (number of rows read, list of dicts of normalised field values for each row having a
+    barcode, list of (pk, field) for rows rejected because a value is too long to be stored).
+    """
+    lo, hi = bounds
+    count = 0
+    records = []
+    rejected = []
+    rows = TexpressData.objects.filter(pk__gte=lo, pk__lt=hi).values_list('pk', 'row')
+    for pk, row in rows.iterator():
+        count += 1
+        barcode = _value(row, 'barcode')
+        if not barcode:
+            continue
+        overlong = [f for f, length in FIELD_MAX_LENGTHS.items() if len(_value(row, f) or '') > length]
+        if overlong:
+            rejected += [(pk, f) for f in overlong]
+            continue
+        date, temporal_accuracy = _date(_value(row, 'date'))
+        det_date, _ = _date(_value(row, 'det_date'))
+        lon, lat = _float(_value(row, 'longitude')), _float(_value(row, 'latitude'))
+        records.append({
+            'texpress_id': pk,
+            'barcode': barcode,
+            'collection': _value(row, 'collection'),
+            'linear_sequence': _value(row, 'linear_sequence'),
+            'collector': _value(row, 'collector'),
+            'project': _value(row, 'project'),
+            'permit': _value(row, 'permit'),
+            'date': date,
+            'temporal_accuracy': temporal_accuracy,
+            'locality': _value(row, 'locality'),
+            'coords': (lon, lat) if lon is not None and lat is not None else None,
+            'altitude': _float(_value(row, 'altitude')),
+            'name': _value(row, 'name'),
+            'determiner': _value(row, 'determiner'),
+            'det_date': det_date,
+        })
+    return count, records, rejected
+
+
+class TexpressETL:
+    """Loads Texpress archive rows into the normalised herbarium models. Lookup caches of
+    existing objects (person name, project name, permit no, Name.name and specimen barcode
+    to pk) are held in memory so that rows can be deduplicated without per-row queries.
+    Each chunk of rows is written using audited_bulk_create, one model at a time in dependency
+    order, inside a single transaction.
+
+    Each created Location, CollectingEvent, Specimen and Designation records the source
+    TexpressData pk in `metadata['texpress_id']`. Rows whose barcode already exists as a
+    Specimen are skipped, so the ETL can safely be re-run. The ETL should not be run while
+    the lookup models are being edited, as new objects are assumed not to exist already.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.persons = dict(Person.objects.values_list('name', 'pk'))
+        self.projects = dict(Project.objects.values_list('name', 'pk'))
+        self.permits = dict(Permit.objects.values_list('permit_no', 'pk'))
+        self.names = dict(Name.objects.values_list('name', 'pk'))
+        self.specimens = dict(Specimen.objects.values_list('barcode', 'pk'))
+
+    def lookup(self, cache, model, field, values, **defaults):
+        """Ensure that objects exist for each of the passed-in values of a unique field,
+        creating any missing objects in bulk and adding their pks to the cache.
+        """
+        new = {v for v in values if v and v not in cache}
+        if new:
+            # The caches hold every existing value, so these objects don't conflict (and their
+            # pks are returned by bulk_create, which is required to record their revisions).
+            objs = model.objects.audited_bulk_create([model(**{field: v}, **defaults) for v in new], user=self.user)
+            cache.update((getattr(obj, field), obj.pk) for obj in objs)
+
+    def load(self, records):
+        """Load a list of transformed records into the database. Returns the number of
+        specimens created.
+        """
+        # Skip records for specimens already loaded (including duplicates in this chunk).
+        todo = []
+        seen = set()
+        for r in records:
+            if r['barcode'] not in self.specimens and r['barcode'] not in seen:
+                seen.add(r['barcode'])
+                todo.append(r)
+        if not todo:
+            return 0
+
+        with transaction.atomic():
+            self.lookup(self.persons, Person, 'name', [r['collector'] for r in todo], type='Collector')
+            self.lookup(self.persons, Person, 'name', [r['determiner'] for r in todo], type='Taxonomist')
+            self.lookup(self.projects, Project, 'name', [r['project'] for r in todo])
+            self.lookup(self.permits, Permit, 'permit_no', [r['permit'] for r in todo])
+
+            # Locations
+            loc_records = [r for r in todo if r['coords'] or r['locality']]
+            locations = Location.objects.audited_bulk_create([Location(
+                description=r['locality'],
+                point=Point(*r['coords'], srid=4283) if r['coords'] else None,
+                altitude=r['altitude'],
+                metadata={'texpress_id': r['texpress_id']},
+            ) for r in loc_records], user=self.user)
+            for r, loc in zip(loc_records, locations):
+                r['location_id'] = loc.pk
+
+            # Collecting events (a collector is required).
+            event_records = [r for r in todo if r['collector']]
+            events = CollectingEvent.objects.audited_bulk_create([CollectingEvent(
+                person_id=self.persons[r['collector']],
+                project_id=self.projects.get(r['project']),
+                permit_id=self.permits.get(r['permit']),
+                date=r['date'],
+                temporal_accuracy=r['temporal_accuracy'],
+                location_id=r.get('location_id'),
+                metadata={'texpress_id': r['texpress_id']},
+            ) for r in event_records], user=self.user)
+            for r, event in zip(event_records, events):
+                r['event_id'] = event.pk
+
+            # Specimens
+            specimens = Specimen.objects.audited_bulk_create([Specimen(
+                barcode=r['barcode'],
+                event_id=r.get('event_id'),
+                collection=r['collection'],
+                linear_sequence=r['linear_sequence'],
+                metadata={'texpress_id': r['texpress_id']},
+            ) for r in todo], user=self.user)
+
+            # Designations (a known name, determiner and date are required).
+            designations = []
+            for r, specimen in zip(todo, specimens):
+                if r['name'] in self.names and r['determiner'] and r['det_date']:
+                    designations.append(Designation(
+                        person_id=self.persons[r['determiner']],
+                        name_id=self.names[r['name']],
+                        specimen_id=specimen.pk,
+                        date=r['det_date'],
+                        metadata={'texpress_id': r['texpress_id']},
+                    ))
+            Designation.objects.audited_bulk_create(designations, user=self.user)
+
+        # Only update the specimen cache once the chunk has been committed.
+        self.specimens.update((s.barcode, s.pk) for s in specimens)
+        return len(specimens)
+
+
+def migrate_texpress_data(chunk_size=10000, processes=None, user_id=1):
+    """Utility function to migrate Texpress archive data into the normalised herbarium models.
+    Rows are read and transformed in pk range chunks by a pool of worker processes, and each
+    chunk is then bulk loaded by this process (see TexpressETL).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM herbarium_texpressdata')
+        min_pk, max_pk = cursor.fetchone()
+    if min_pk is None:
+        print('No Texpress data to migrate')
+        return
+    ranges = [(lo, lo + chunk_size) for lo in range(min_pk, max_pk + 1, chunk_size)]
+
+    count = 0
+    rows = 0
+    rejected = 0
+    start = perf_counter()
+    print('Starting migration of Texpress data ({} chunks)'.format(len(ranges)))
+    # Don't carry an open database connection into the forked worker processes.
+    connection.close()
+
+    with Pool(processes) as pool:
+        etl = TexpressETL(get_user_model().objects.get(pk=user_id))
+        for done, (read, records, overlong) in enumerate(pool.imap(_transform_range, ranges), 1):
+            for pk, field in overlong:
+                print('Skipped TexpressData {}: {} is longer than {} characters'.format(
+                    pk, field, FIELD_MAX_LENGTHS[field]))
+            rejected += len({pk for pk, _ in overlong})
+            created = etl.load(records)
+            count += created
+            rows += read
+            elapsed = perf_counter() - start
+            print('Chunk {}/{}: {} specimens created; {} total, {:.0f} rows/sec'.format(
+                done, len(ranges), created, count, rows / max(elapsed, 1e-6)))
+
+    print('Migrated {} specimens from {} rows in {:.2f} sec ({} rows skipped with overlong values)'.format(
+        count, rows, perf_counter() - start, rejected))
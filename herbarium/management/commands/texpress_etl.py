@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from herbarium.etl import migrate_texpress_data
+
+
+class Command(BaseCommand):
+    help = 'Migrates Texpress archive data into the normalised herbarium models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', action='store', type=int, default=10000, dest='chunk_size',
+            help='Number of TexpressData pks per chunk (default 10000)')
+        parser.add_argument(
+            '--processes', action='store', type=int, default=None, dest='processes',
+            help='Number of worker processes (default: number of CPUs)')
+        parser.add_argument(
+            '--user', action='store', type=int, default=1, dest='user_id',
+            help='User ID to record as the creator of migrated objects (default 1)')
+
+    def handle(self, *args, **options):
+        migrate_texpress_data(
+            chunk_size=options['chunk_size'], processes=options['processes'], user_id=options['user_id'])
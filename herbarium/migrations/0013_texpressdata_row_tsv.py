@@ -0,0 +1,39 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('herbarium', '0012_auto_20200629_0758'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='texpressdata',
+            name='row_tsv',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='texpressdata',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['row_tsv'], name='herbarium_t_row_tsv_e43bce_gin'),
+        ),
+        # Maintain row_tsv from the string & numeric values of the row on every insert (including
+        # COPY) or update. Existing rows are populated by utils.update_texpress_search_vectors().
+        migrations.RunSQL(
+            """CREATE FUNCTION herbarium_texpressdata_row_tsv() RETURNS trigger AS $$
+            BEGIN
+                NEW.row_tsv := jsonb_to_tsvector('simple', NEW."row", '["string", "numeric"]');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+            CREATE TRIGGER herbarium_texpressdata_row_tsv
+                BEFORE INSERT OR UPDATE OF "row" ON herbarium_texpressdata
+                FOR EACH ROW EXECUTE PROCEDURE herbarium_texpressdata_row_tsv();""",
+            """DROP TRIGGER herbarium_texpressdata_row_tsv ON herbarium_texpressdata;
+            DROP FUNCTION herbarium_texpressdata_row_tsv();""",
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('herbarium', '0013_texpressdata_row_tsv'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TexpressImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='Absolute path of the imported file', max_length=1024, unique=True)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import JSONField
 from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 import json
 from nomenclature.models import Name
 from waherb.utils import AuditMixin, ActiveMixin
@@ -11,10 +12,12 @@ class TexpressData(models.Model):
     """
     row = JSONField(default=dict, blank=True)
     row_text = models.TextField(help_text='Document for search', blank=True, null=True)
+    # Full-text search vector of the row values, maintained by a database trigger.
+    row_tsv = SearchVectorField(blank=True, null=True, editable=False)
 
     class Meta:
         verbose_name_plural = 'texpress data'
-        indexes = [GinIndex(fields=['row'])]
+        indexes = [GinIndex(fields=['row']), GinIndex(fields=['row_tsv'])]
 
     def __str__(self):
         # Don't just use the string repr of the JSONField, as that outputs single quotes
@@ -26,6 +29,18 @@ class TexpressData(models.Model):
             return s[:200] + '...(more)'
 
 
+class TexpressImport(models.Model):
+    """The progress of an import of Texpress data from a flat file: the byte offset in the file
+    of the last batch loaded, which is updated in the same transaction as the batch itself.
+    """
+    path = models.CharField(max_length=1024, unique=True, help_text='Absolute path of the imported file')
+    offset = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.path, self.offset)
+
+
 ATTACHMENT_TYPE_CHOICES = (
     ('Specimen photo', 'Specimen photo'),
 )
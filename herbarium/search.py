@@ -0,0 +1,92 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q
+import math
+import re
+from .models import TexpressData
+
+
+# Text search configuration used for the TexpressData row_tsv column (see migration 0013).
+# The 'simple' configuration doesn't stem words, which suits names, localities and codes.
+SEARCH_CONFIG = 'simple'
+
+
+def search_texpress(term, queryset=None):
+    """Full-text search over the Texpress archive using the indexed row_tsv column.
+    Returns a queryset of TexpressData objects matching all the words in `term`, annotated
+    with `rank` and ordered by relevance. The query is parameterised, and limit/offset can be
+    applied by slicing the returned queryset as normal.
+    """
+    if queryset is None:
+        queryset = TexpressData.objects.all()
+    query = SearchQuery(term, config=SEARCH_CONFIG)
+    return queryset.filter(row_tsv=query).annotate(
+        rank=SearchRank(F('row_tsv'), query),
+    ).order_by('-rank', 'pk')
+
+
+# Tokens in a Texpress query: `key:value`, `key:"quoted value"` (keys may also be quoted, as in
+# a JSON fragment), a "quoted phrase" or a bare word. Keys must start with a letter and be
+# followed directly by the value, so that words such as `10:30`, `http://x` or `note:` followed
+# by a space are treated as free text.
+QUERY_TOKEN_RE = re.compile(
+    r'"?(?P<key>[A-Za-z]\w*)"?:(?:"(?P<quoted>[^"]*)"|(?P<value>[^\s/"]\S*))|"(?P<phrase>[^"]*)"|(?P<word>\S+)')
+
+
+def parse_texpress_query(query):
+    """Parse a Texpress query string into a tuple of (list of (key, value) tuples, list of free
+    text terms). E.g. 'locality:"Mount Lesueur" collector:Smith banksia' returns:
+    ([('locality', 'Mount Lesueur'), ('collector', 'Smith')], ['banksia'])
+    """
+    scoped = []
+    text = []
+    for match in QUERY_TOKEN_RE.finditer(query):
+        if match.group('key'):
+            value = match.group('quoted') if match.group('quoted') is not None else match.group('value')
+            scoped.append((match.group('key'), value))
+        elif match.group('phrase'):
+            text.append(match.group('phrase'))
+        elif match.group('word'):
+            text.append(match.group('word'))
+    return scoped, text
+
+
+def key_query(key, value):
+    """Returns a Q object for a key-scoped lookup on the TexpressData row, using the jsonb
+    containment (@>) and existence (?) operators which can use the GIN index on row.
+    A value of '*' matches rows having the key. Otherwise the value must match the key's value
+    exactly (case-sensitive), or be an element of it where the key holds a list.
+    """
+    if value == '*':
+        return Q(row__has_key=key)
+    values = [value]
+    try:
+        values.append(int(value))
+    except ValueError:
+        try:
+            number = float(value)
+        except ValueError:
+            pass
+        else:
+            # NaN and infinite values can't be stored in jsonb.
+            if math.isfinite(number):
+                values.append(number)
+    q = Q()
+    for v in values:
+        q |= Q(row__contains={key: v}) | Q(row__contains={key: [v]})
+    return q
+
+
+def search_texpress_query(query, queryset=None):
+    """Search the Texpress archive using a query string containing key-scoped terms
+    (`key:value`, `key:"quoted value"`, `key:*`) and/or free text. Key-scoped terms are all
+    required to match; free text terms are passed to search_texpress() (in which case results
+    are ranked by relevance).
+    """
+    if queryset is None:
+        queryset = TexpressData.objects.all()
+    scoped, text = parse_texpress_query(query)
+    for key, value in scoped:
+        queryset = queryset.filter(key_query(key, value))
+    if text:
+        queryset = search_texpress(' '.join(text), queryset)
+    return queryset
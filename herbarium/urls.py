@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import TexpressDataAPI
+
+app_name = 'herbarium'
+urlpatterns = [
+    path('herbarium/api/texpress/', TexpressDataAPI.as_view(), name='api_texpress'),
+]
@@ -1,65 +1,260 @@
 import json
-from datetime import datetime
-from .models import TexpressData
+import os
+from django.db import connection, transaction
+from io import StringIO
+from multiprocessing import Pool
+from time import perf_counter
+from waherb.loaders import copy_value, parallel_copy, read_batches
+from .models import TexpressData, TexpressImport
+from .search import SEARCH_CONFIG
 
 
-def import_texpress_data(path='/var/www/archive/texpress_json_rows.json'):
+def _strip_nul(value):
+    """Recursively remove NUL characters from the strings in a parsed JSON value.
+    """
+    if isinstance(value, str):
+        return value.replace('\x00', '')
+    if isinstance(value, list):
+        return [_strip_nul(i) for i in value]
+    if isinstance(value, dict):
+        return {_strip_nul(k): _strip_nul(v) for k, v in value.items()}
+    return value
+
+
+def _parse_texpress_lines(lines):
+    """Worker function: parse a batch of raw Texpress JSON lines and return a tuple of
+    (COPY text buffer, row count, list of rejected lines). Runs inside a process pool, so it
+    must not touch the database.
+    """
+    out = []
+    rejected = []
+    for line in lines:
+        text = line.decode('utf-8').strip()
+        if not text:
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            rejected.append(text)
+            continue
+        if '\\u0000' in text:
+            # jsonb can't store NUL characters, so strip them before loading.
+            row = _strip_nul(row)
+        out.append('{}\t{}\n'.format(copy_value(json.dumps(row)), copy_value(text)))
+    return ''.join(out), len(out), rejected
+
+
+def _texpress_batches(f, batch_size, offset):
+    """Generator to read a binary file object from byte `offset`, yielding tuples of
+    (list of lines, byte offset at the end of the batch).
+    """
+    for batch in read_batches(f, batch_size):
+        offset += sum(len(line) for line in batch)
+        yield batch, offset
+
+
+def import_texpress_data(path='/var/www/archive/texpress_json_rows.json', batch_size=10000, processes=None, resume=True):
     """Utility function to import Texpress data from the flat file output.
+
+    The file is streamed line by line and JSON parsing is spread across a process pool (see
+    waherb.loaders.parallel_copy). Each parsed batch is written to the herbarium_texpressdata
+    table using COPY, and the byte offset of the end of the batch is recorded as a
+    TexpressImport checkpoint in the same transaction, so a batch and its checkpoint are always
+    committed together. If the import fails partway, re-running it with `resume=True` will
+    continue from the last checkpoint. The checkpoint is removed once the import completes.
+    """
+    path = os.path.abspath(path)
+    checkpoint = TexpressImport.objects.filter(path=path).first()
+    offset = 0
+    if resume and checkpoint:
+        offset = checkpoint.offset
+        print('Resuming import of Texpress data from byte offset {}'.format(offset))
+    else:
+        print('Starting import of Texpress data')
+
+    start = perf_counter()
+    # Don't carry an open database connection into the forked worker processes.
+    connection.close()
+
+    def copy(buf, end):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.copy_expert('COPY herbarium_texpressdata (row, row_text) FROM STDIN', StringIO(buf))
+            TexpressImport.objects.update_or_create(path=path, defaults={'offset': end})
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        count, rejected = parallel_copy(_texpress_batches(f, batch_size, offset), _parse_texpress_lines, copy, processes)
+
+    TexpressImport.objects.filter(path=path).delete()
+    elapsed = perf_counter() - start
+    print('Imported {} records ({} rejected) in {:.2f} sec, {:.0f} records/sec'.format(
+        count, rejected, elapsed, count / max(elapsed, 1e-6)))
+
+
+def _join_list(value):
+    """Merge a multi-element list of strings into a single space-separated string.
+    """
+    return ' '.join([i for i in value if i])
+
+
+# Available sanitise transforms: name -> (Python function, SQL expression template).
+# Each transform only applies to keys holding a list (jsonb array) value. The SQL expression
+# must evaluate to the new jsonb value for the key; `{key}` is replaced by the row key.
+SANITISE_TRANSFORMS = {
+    'join': (
+        _join_list,
+        """to_jsonb(COALESCE((
+            SELECT string_agg(e.value, ' ' ORDER BY e.n)
+            FROM jsonb_array_elements_text(row->'{key}') WITH ORDINALITY AS e(value, n)
+            WHERE e.value <> ''), ''))""",
+    ),
+}
+
+# Declarative list of (row key, transform name) applied to TexpressData by sanitise_data().
+TEXPRESS_SANITISE_RULES = [
+    ('vegetati', 'join'),
+    ('plantdes', 'join'),
+    ('sitedesc', 'join'),
+    ('locality', 'join'),
+    ('voucher', 'join'),
+    ('fre', 'join'),
+]
+
+
+def _sanitise_patch_sql(rules):
+    """Returns an SQL expression evaluating to a jsonb object of the transformed keys for a row,
+    suitable for concatenating onto the row (`row || patch`). Keys not needing a transform
+    are stripped from the patch.
+    """
+    pairs = []
+    for key, transform in rules:
+        sql = SANITISE_TRANSFORMS[transform][1].format(key=key)
+        pairs.append("'{0}', CASE WHEN jsonb_typeof(row->'{0}') = 'array' THEN {1} END".format(key, sql))
+    return 'jsonb_strip_nulls(jsonb_build_object({}))'.format(', '.join(pairs))
+
+
+def sanitise_row(row, rules=TEXPRESS_SANITISE_RULES):
+    """Apply the sanitise transforms to a single row dict in place. Returns True if the row
+    was changed.
+    """
+    changed = False
+    for key, transform in rules:
+        if key in row and isinstance(row[key], list):
+            row[key] = SANITISE_TRANSFORMS[transform][0](row[key])
+            changed = True
+    return changed
+
+
+def _sanitise_range_sql(lo, hi, rules):
+    """Set-based sanitise of TexpressData rows with lo <= pk < hi, in a single UPDATE.
+    Rows which are already clean are not rewritten. Returns the number of rows updated.
+    """
+    patch = _sanitise_patch_sql(rules)
+    sql = """UPDATE herbarium_texpressdata
+        SET row = row || {0}, row_text = (row || {0})::text
+        WHERE id >= %s AND id < %s AND row_text IS DISTINCT FROM (row || {0})::text""".format(patch)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (lo, hi))
+            return cursor.rowcount
+
+
+def _sanitise_range_python(args):
+    """Worker function: sanitise TexpressData rows with lo <= pk < hi in Python, then write
+    the changed rows back using bulk_update. Returns a tuple of (lo, hi, rows updated).
+    """
+    lo, hi, rules = args
+    updates = []
+    for tex in TexpressData.objects.filter(pk__gte=lo, pk__lt=hi).only('pk', 'row').iterator():
+        if sanitise_row(tex.row, rules):
+            updates.append(tex)
+    with transaction.atomic():
+        TexpressData.objects.bulk_update(updates, ['row'], batch_size=1000)
+        # Set row_text from the database so that it matches the jsonb text representation,
+        # which is the same output as the set-based path.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """UPDATE herbarium_texpressdata SET row_text = row::text
+                WHERE id >= %s AND id < %s AND row_text IS DISTINCT FROM row::text""",
+                (lo, hi),
+            )
+    return lo, hi, len(updates)
+
+
+def sanitise_data(mode='sql', chunk_size=50000, processes=None, start_pk=None, rules=TEXPRESS_SANITISE_RULES):
+    """Utility function to clean up imported Texpress data, by applying the declarative list of
+    transforms in `rules` to each row, and setting `row_text` to the JSON text of the row.
+
+    With `mode='sql'` (the default), each pk range of `chunk_size` rows is sanitised by a single
+    set-based UPDATE statement. Pass `chunk_size=None` to sanitise the whole table in one
+    statement. With `mode='python'`, pk ranges are processed in parallel worker processes
+    and saved with bulk_update.
+
+    Each chunk is committed separately, and rows that are already clean are skipped, so the
+    process is restartable: re-run it (optionally passing the `start_pk` printed in the
+    progress output) to continue after a failure.
     """
-    f = open(path)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM herbarium_texpressdata')
+        min_pk, max_pk = cursor.fetchone()
+    if min_pk is None:
+        print('No Texpress data to sanitise')
+        return
+    if start_pk is not None:
+        min_pk = max(min_pk, start_pk)
+    step = chunk_size or max_pk - min_pk + 1
+    ranges = [(lo, min(lo + step, max_pk + 1), rules) for lo in range(min_pk, max_pk + 1, step)]
+
     count = 0
-    then = datetime.now()
-    print('Starting import of Texpress data')
-    new_records = []
-
-    for line in f.readlines():
-        new_records.append(TexpressData(row=json.loads(line), row_text=line.strip()))
-        count += 1
-        if count % 1000 == 0:  # Commit our new records to the database.
-            TexpressData.objects.bulk_create(new_records)  # bulk_create is WAY faster.
-            new_records = []
-            elapsed = (datetime.now() - then).seconds
-            print('Processed {} records, {:.2f} sec/1000 records'.format(count, elapsed))
-            then = datetime.now()
-
-    if new_records:  # Save any remaining records in our list.
-        TexpressData.objects.bulk_create(new_records)
-        new_records = []
-
-
-def sanitise_data():
-    """Utility function to clean up imported Texpress data.
+    start = perf_counter()
+    print('Starting sanitise ({} mode, {} chunks)'.format(mode, len(ranges)))
+
+    def progress(done, lo, hi, updated):
+        elapsed = perf_counter() - start
+        print('Chunk {}/{} (pk {}-{}): {} records updated; {} total, {:.2f} sec elapsed. Resume with start_pk={}'.format(
+            done, len(ranges), lo, hi - 1, updated, count, elapsed, hi))
+
+    if mode == 'sql':
+        for done, (lo, hi, _) in enumerate(ranges, 1):
+            updated = _sanitise_range_sql(lo, hi, rules)
+            count += updated
+            progress(done, lo, hi, updated)
+    elif mode == 'python':
+        # Don't carry an open database connection into the forked worker processes.
+        connection.close()
+        with Pool(processes) as pool:
+            # Results are returned in order, so the resume point printed is always safe.
+            for done, (lo, hi, updated) in enumerate(pool.imap(_sanitise_range_python, ranges), 1):
+                count += updated
+                progress(done, lo, hi, updated)
+    else:
+        raise ValueError('Unknown sanitise mode: {}'.format(mode))
+
+    print('Sanitised {} records in {:.2f} sec'.format(count, perf_counter() - start))
+
+
+def update_texpress_search_vectors(chunk_size=50000):
+    """Utility function to populate the row_tsv search vector column for existing Texpress
+    data, in pk range chunks. New & updated rows are maintained by a database trigger.
     """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM herbarium_texpressdata')
+        min_pk, max_pk = cursor.fetchone()
+    if min_pk is None:
+        return
     count = 0
-    then = datetime.now()
-    print('Starting sanitise')
-
-    for tex in TexpressData.objects.iterator():  # Use iterator() or we'll be OOM in no time.
-        # TODO: switch to using bulk_update instead.
-        # Merge multi-element string fields into a single string:
-        if 'vegetati' in tex.row and isinstance(tex.row['vegetati'], list):
-            tex.row['vegetati'] = ' '.join([i for i in tex.row['vegetati'] if i])
-        if 'plantdes' in tex.row and isinstance(tex.row['plantdes'], list):
-            tex.row['plantdes'] = ' '.join([i for i in tex.row['plantdes'] if i])
-        if 'sitedesc' in tex.row and isinstance(tex.row['sitedesc'], list):
-            tex.row['sitedesc'] = ' '.join([i for i in tex.row['sitedesc'] if i])
-        if 'locality' in tex.row and isinstance(tex.row['locality'], list):
-            tex.row['locality'] = ' '.join([i for i in tex.row['locality'] if i])
-        if 'voucher' in tex.row and isinstance(tex.row['voucher'], list):
-            tex.row['voucher'] = ' '.join([i for i in tex.row['voucher'] if i])
-        if 'fre' in tex.row and isinstance(tex.row['fre'], list):
-            tex.row['fre'] = ' '.join([i for i in tex.row['fre'] if i])
-        # Convert single-element arrays into just that single element's value.
-        # Probably no longer needed.
-        #for key, val in tex.row.items():
-        #    if isinstance(val, list) and len(val) == 1:
-        #        tex.row[key] = val[0]
-        # Save JSON data into the indexed row_text field.
-        tex.row_text = str(tex.row)
-        tex.save()
-
-        count += 1
-        if count % 1000 == 0:
-            elapsed = (datetime.now() - then).seconds
-            print('Processed {} records, {:.2f} sec/1000 records'.format(count, elapsed))
-            then = datetime.now()
+    start = perf_counter()
+    print('Starting update of Texpress search vectors')
+
+    for lo in range(min_pk, max_pk + 1, chunk_size):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """UPDATE herbarium_texpressdata
+                    SET row_tsv = jsonb_to_tsvector(%s, row, '["string", "numeric"]')
+                    WHERE id >= %s AND id < %s""",
+                    (SEARCH_CONFIG, lo, lo + chunk_size),
+                )
+                count += cursor.rowcount
+        print('Processed {} records, {:.2f} sec elapsed'.format(count, perf_counter() - start))
@@ -0,0 +1,30 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+from .search import search_texpress_query
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class TexpressDataAPI(View):
+    """API endpoint to query the Texpress archive. Accepts a query string in parameter `q`,
+    which may contain key-scoped terms (e.g. `locality:"Mount Lesueur" collector:Smith`)
+    and/or free text. Results are paged using the `limit` and `offset` parameters.
+    """
+    http_method_names = ['get']
+    default_limit = 100
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        if 'q' in request.GET and request.GET['q']:
+            try:
+                limit = max(1, min(int(request.GET.get('limit', self.default_limit)), self.max_limit))
+                offset = max(int(request.GET.get('offset', 0)), 0)
+            except ValueError:
+                limit, offset = self.default_limit, 0
+            qs = search_texpress_query(request.GET['q']).values('id', 'row')
+            rows = list(qs[offset:offset + limit])
+        else:
+            rows = []
+
+        return JsonResponse(rows, safe=False)
@@ -1,10 +1,10 @@
 from django.contrib import admin
 from .models import TaxonLocation
-from waherb.utils import WALeafletGeoAdmin
+from waherb.utils import LargeTableAdminMixin, WALeafletGeoAdmin
 
 
 @admin.register(TaxonLocation)
-class TaxaLocationAdmin(WALeafletGeoAdmin):
+class TaxaLocationAdmin(LargeTableAdminMixin, WALeafletGeoAdmin):
     fields = (
         'name', 'point', 'published_name', 'supra', 'family', 'kingdom', 'conservation_status',
         'vernacular', 'collector', 'collected_date', 'survey', 'source', 'metadata')
@@ -14,4 +14,3 @@ class TaxaLocationAdmin(WALeafletGeoAdmin):
     search_fields = (
         'name', 'published_name__name', 'supra', 'family', 'kingdom', 'vernacular', 'survey',
         'source__name')
-    show_full_result_count = False
@@ -0,0 +1,61 @@
+from django.db import DatabaseError, connection, transaction
+import hashlib
+from waherb.cache import get_cache
+from .filters import FilterError
+
+
+# Precision (in degrees, about 10 cm) to which query polygon vertices are snapped.
+POLYGON_GRID_SIZE = 0.000001
+# Maximum number of vertices in each subdivided piece of a query polygon.
+SUBDIVIDE_MAX_VERTICES = 64
+# Subdivided polygons depend only on the polygon, so they are cached for a long time.
+POLYGON_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def prepare_polygon(wkt):
+    """Validate a WKT polygon (GDA94) and prepare it for use as a query area: vertices are snapped
+    to POLYGON_GRID_SIZE, the geometry is made valid and then split with ST_Subdivide into pieces
+    with at most SUBDIVIDE_MAX_VERTICES vertices, each of which has a compact bounding box that
+    the spatial index can use. Results are cached by a hash of the WKT.
+
+    Returns a tuple of (bounding box EWKB, list of piece EWKB), hex-encoded. Raises FilterError
+    if the WKT is invalid or doesn't contain a polygon.
+    """
+    key = 'polygon:{}'.format(hashlib.md5(wkt.encode('utf-8')).hexdigest())
+    cache = get_cache()
+    prepared = cache.get(key)
+    if prepared is not None:
+        return prepared
+
+    sql = """WITH pieces AS (
+            SELECT ST_Subdivide(ST_CollectionExtract(ST_MakeValid(
+                ST_SnapToGrid(ST_GeomFromText(%s, 4283), %s)), 3), %s) AS geom
+        )
+        SELECT encode(ST_AsEWKB(p.geom), 'hex'), encode(ST_AsEWKB(e.geom), 'hex')
+        FROM pieces p, (SELECT ST_Envelope(ST_Collect(geom)) AS geom FROM pieces) e
+        WHERE NOT ST_IsEmpty(p.geom)"""
+    try:
+        # Use a savepoint, so that invalid WKT doesn't break any surrounding transaction.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, (wkt, POLYGON_GRID_SIZE, SUBDIVIDE_MAX_VERTICES))
+            rows = cursor.fetchall()
+    except DatabaseError:
+        raise FilterError('poly must be a valid WKT polygon')
+    if not rows:
+        raise FilterError('poly must be a valid WKT polygon')
+
+    prepared = (rows[0][1], [row[0] for row in rows])
+    cache.set(key, prepared, POLYGON_CACHE_TIMEOUT)
+    return prepared
+
+
+def polygon_filter(wkt):
+    """Returns a tuple of (SQL WHERE clause, params) to filter TaxonLocation objects within a WKT
+    polygon. The table is joined against the subdivided pieces of the polygon (see
+    prepare_polygon), after a pre-filter on the polygon bounding box.
+    """
+    envelope, pieces = prepare_polygon(wkt)
+    sql = """point && %s::geometry AND id IN (
+        SELECT t.id FROM unnest(%s::geometry[]) AS piece(geom)
+        JOIN naturemap_taxonlocation t ON t.point && piece.geom AND ST_Intersects(t.point, piece.geom))"""
+    return sql, (envelope, pieces)
@@ -0,0 +1,55 @@
+from django.db import connection
+from .filters import FilterError
+
+
+# Approximate size of a cluster grid cell, in screen pixels at a given zoom level.
+CLUSTER_CELL_PIXELS = 64
+MAX_ZOOM = 24
+
+
+def grid_size(zoom):
+    """Returns the grid cell size in degrees for a zoom level of the lat/lon (EPSG:4326) tile
+    grid used by the Naturemap map widget, where the world is 512 x 256 pixels at zoom 0.
+    """
+    return 180.0 * CLUSTER_CELL_PIXELS / (256 * 2 ** zoom)
+
+
+def parse_zoom(value):
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        raise FilterError('zoom must be an integer')
+    if zoom < 0 or zoom > MAX_ZOOM:
+        raise FilterError('zoom must be between 0 and {}'.format(MAX_ZOOM))
+    return zoom
+
+
+def grid_clusters(clauses, params, zoom, bbox=None):
+    """Aggregate the TaxonLocation objects matching the passed-in list of SQL WHERE clauses &
+    params into grid cell clusters, sized for the passed-in zoom level and optionally limited
+    to a bounding box (minx, miny, maxx, maxy). Points are bucketed with ST_SnapToGrid, so the
+    number of clusters returned depends upon the zoom level and bbox, not the number of matches.
+
+    Returns a list of dicts with the count and centroid of each cluster (plus the id & name of
+    the object for single-object clusters).
+    """
+    clauses = list(clauses)
+    params = list(params)
+    if bbox:
+        clauses.append('point && ST_MakeEnvelope(%s, %s, %s, %s, 4283)')
+        params.extend(bbox)
+    sql = """SELECT count(*), avg(ST_X(point)), avg(ST_Y(point)),
+            CASE WHEN count(*) = 1 THEN min(id) END, CASE WHEN count(*) = 1 THEN min(name) END
+        FROM naturemap_taxonlocation
+        WHERE {}
+        GROUP BY ST_SnapToGrid(point, %s)""".format(' AND '.join(clauses))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [grid_size(zoom)])
+        rows = cursor.fetchall()
+    clusters = []
+    for count, lon, lat, pk, name in rows:
+        cluster = {'count': count, 'lon': lon, 'lat': lat}
+        if count == 1:
+            cluster.update({'id': pk, 'name': name})
+        clusters.append(cluster)
+    return clusters
@@ -0,0 +1,117 @@
+from array import array
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+import json
+import sys
+import zlib
+
+
+# TaxonLocation fields which may be selected as GeoJSON feature properties.
+GEOJSON_PROPERTIES = (
+    'name', 'supra', 'family', 'kingdom', 'conservation_status', 'vernacular', 'collector',
+    'collected_date', 'survey',
+)
+GEOJSON_HEADER = '{"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": "EPSG:4283"}}, "features": ['
+
+
+def geojson_properties(fields):
+    """Returns the list of valid GeoJSON property field names from a comma-separated string
+    (defaults to just `name`).
+    """
+    properties = [f for f in (fields or '').split(',') if f in GEOJSON_PROPERTIES]
+    return properties or ['name']
+
+
+def stream_geojson(where, params, properties=('name',), chunk_size=2000):
+    """Generator which yields a GeoJSON FeatureCollection of the TaxonLocation objects matching
+    the passed-in SQL WHERE clause & params, in chunks of text. Each feature is serialised to
+    JSON by PostgreSQL (using ST_AsGeoJSON) and read through a server-side cursor, so memory use
+    stays flat regardless of the number of features.
+    """
+    props = ', '.join("'{0}', {0}".format(p) for p in properties if p in GEOJSON_PROPERTIES)
+    sql = """SELECT json_build_object(
+            'type', 'Feature', 'id', id, 'geometry', ST_AsGeoJSON(point)::json,
+            'properties', json_build_object({}))::text
+        FROM naturemap_taxonlocation WHERE {}""".format(props, where)
+    yield GEOJSON_HEADER
+    # A named (server-side) cursor must be used inside a transaction.
+    with transaction.atomic():
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(sql, params)
+            separator = ''
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield separator + ','.join(row[0] for row in rows)
+                separator = ','
+        finally:
+            cursor.close()
+    yield ']}'
+
+
+def gzip_stream(chunks):
+    """Generator to gzip-compress a stream of text chunks.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def geojson_response(where, params, filename, properties=('name',), gzip=False):
+    """Returns a StreamingHttpResponse to download TaxonLocation objects matching the passed-in
+    SQL WHERE clause & params as a GeoJSON file, optionally gzip-compressed.
+    """
+    chunks = stream_geojson(where, params, properties)
+    if gzip:
+        resp = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        resp = StreamingHttpResponse(chunks, content_type='application/json')
+    resp['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return resp
+
+
+def columnar_points(rows, fields):
+    """Encode a list of (id, lon, lat, *field values) rows as a columnar dict: arrays of `ids`,
+    `lons` and `lats`, plus a dictionary encoding of each field (the list of distinct `values`,
+    and the `index` into that list for each row). This avoids repeating keys and names per row.
+    """
+    ids, lons, lats = [], [], []
+    properties = {field: {'values': [], 'index': []} for field in fields}
+    lookups = {field: {} for field in fields}
+    for row in rows:
+        ids.append(row[0])
+        lons.append(row[1])
+        lats.append(row[2])
+        for field, value in zip(fields, row[3:]):
+            lookup = lookups[field]
+            i = lookup.get(value)
+            if i is None:
+                i = lookup[value] = len(lookup)
+                properties[field]['values'].append(value)
+            properties[field]['index'].append(i)
+    return {'ids': ids, 'lons': lons, 'lats': lats, 'properties': properties}
+
+
+def packed_points(rows):
+    """Encode a list of (id, lon, lat, name) rows as packed little-endian binary: int32 ids,
+    float32 lons, float32 lats and int32 name indexes (each an array of the row count), followed
+    by a UTF-8 JSON list of the distinct names.
+    """
+    ids, lons, lats, indexes = array('i'), array('f'), array('f'), array('i')
+    names = {}
+    for pk, lon, lat, name in rows:
+        ids.append(pk)
+        lons.append(lon)
+        lats.append(lat)
+        indexes.append(names.setdefault(name, len(names)))
+    arrays = (ids, lons, lats, indexes)
+    if sys.byteorder == 'big':
+        for a in arrays:
+            a.byteswap()
+    return b''.join(a.tobytes() for a in arrays) + json.dumps(list(names)).encode('utf-8')
@@ -0,0 +1,97 @@
+from django.db import connection
+
+
+# TaxonLocation fields which are summarised as facets.
+FACET_FIELDS = ('supra', 'family', 'kingdom', 'conservation_status')
+# Intervals available for date histograms, as (date_trunc field, years per interval).
+HISTOGRAM_INTERVALS = {'year': 1, 'decade': 10}
+
+
+def _facet_result(rows):
+    """Returns a dict of the total count plus the facet counts for each facet field (ordered by
+    descending count) from a list of (field, value, count) rows, where field 'total' holds the
+    total count.
+    """
+    result = {'total': 0, 'facets': {field: [] for field in FACET_FIELDS}}
+    for field, value, count in rows:
+        if field == 'total':
+            result['total'] = count
+        else:
+            result['facets'][field].append({'value': value, 'count': count})
+    for counts in result['facets'].values():
+        counts.sort(key=lambda i: (-i['count'], i['value']))
+    return result
+
+
+def _grouping_sql():
+    """Returns SQL expressions for the facet field name and value of a row grouped by
+    GROUPING SETS of the facet fields (plus the empty grouping set, for the total). GROUPING()
+    sets a bit for each field not in the row's grouping set, first field most significant.
+    """
+    n = len(FACET_FIELDS)
+    cases = ' '.join(
+        "WHEN {} THEN '{}'".format((2 ** n - 1) ^ (1 << (n - 1 - i)), field) for i, field in enumerate(FACET_FIELDS))
+    field = "CASE GROUPING({}) {} ELSE 'total' END".format(', '.join(FACET_FIELDS), cases)
+    value = "COALESCE({}, '')".format(', '.join(FACET_FIELDS))
+    grouping_sets = 'GROUPING SETS ({}, ())'.format(', '.join('({})'.format(f) for f in FACET_FIELDS))
+    return field, value, grouping_sets
+
+
+def facet_counts(clauses, params):
+    """Returns the total & facet counts of the TaxonLocation objects matching the passed-in list
+    of SQL WHERE clauses & params, computed in a single grouped query.
+    """
+    field, value, grouping_sets = _grouping_sql()
+    sql = """SELECT {}, {}, count(*) FROM (
+            SELECT {} FROM naturemap_taxonlocation WHERE {}
+        ) AS t GROUP BY {}""".format(
+        field, value, ', '.join("COALESCE({0}, '') AS {0}".format(f) for f in FACET_FIELDS),
+        ' AND '.join(clauses), grouping_sets)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return _facet_result(cursor.fetchall())
+
+
+def rollup_facet_counts(source_id=None):
+    """Returns the total & facet counts of all current TaxonLocation objects (or those of a
+    single source) from the pre-aggregated rollup view.
+    """
+    sql = 'SELECT field, value, sum(count)::integer FROM naturemap_taxonlocationfacet'
+    params = []
+    if source_id is not None:
+        sql += ' WHERE source_id = %s'
+        params.append(source_id)
+    sql += ' GROUP BY field, value'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return _facet_result(cursor.fetchall())
+
+
+def date_histogram(clauses, params, interval='year'):
+    """Returns counts per year or decade of collected_date (using date_trunc) of the TaxonLocation
+    objects matching the passed-in list of SQL WHERE clauses & params, as a dict of a list of
+    `counts` ({'period': first year of the interval, 'count': count}, in date order) plus the
+    count of objects with no collected date.
+    """
+    if interval not in HISTOGRAM_INTERVALS:
+        raise ValueError('Unknown histogram interval: {}'.format(interval))
+    sql = """SELECT EXTRACT(YEAR FROM date_trunc(%s, collected_date))::integer AS period, count(*)
+        FROM naturemap_taxonlocation WHERE {}
+        GROUP BY period ORDER BY period NULLS LAST""".format(' AND '.join(clauses))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [interval] + list(params))
+        rows = cursor.fetchall()
+    result = {'interval': interval, 'counts': [], 'undated': 0}
+    for period, count in rows:
+        if period is None:
+            result['undated'] = count
+        else:
+            result['counts'].append({'period': period, 'count': count})
+    return result
+
+
+def refresh_facet_rollup():
+    """Refresh the materialised view of pre-aggregated facet counts per source.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY naturemap_taxonlocationfacet')
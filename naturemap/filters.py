@@ -0,0 +1,89 @@
+from datetime import datetime
+
+
+# Request parameters used to filter TaxonLocation objects (see taxon_filters).
+FILTER_PARAMS = ('name', 'supra', 'family', 'kingdom', 'source', 'date_from', 'date_to')
+
+
+class FilterError(ValueError):
+    """Raised when a request parameter used to filter TaxonLocation objects is invalid.
+    """
+
+
+def parse_date(value, param):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise FilterError('{} must be a date in the format YYYY-MM-DD'.format(param))
+
+
+def like_escape(value):
+    """Escape the LIKE/ILIKE wildcards (and the default escape character, backslash) in a value,
+    so that it is matched literally within a pattern.
+    """
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def taxon_filters(params):
+    """Returns a tuple of (list of SQL WHERE clauses, list of params) to filter current
+    TaxonLocation objects using the following optional request parameters:
+
+    - name: taxon name (case-insensitive prefix match, which uses the trigram index)
+    - supra, family, kingdom: exact match
+    - source: Source object ID
+    - date_from, date_to: inclusive range of collected_date (YYYY-MM-DD)
+
+    Raises FilterError for invalid parameter values.
+    """
+    clauses = ['effective_to IS NULL']
+    values = []
+    if params.get('name'):
+        clauses.append('name ILIKE %s')
+        values.append('{}%'.format(params['name']))
+    for field in ('supra', 'family', 'kingdom'):
+        if params.get(field):
+            clauses.append('{} = %s'.format(field))
+            values.append(params[field])
+    if params.get('source'):
+        try:
+            values.append(int(params['source']))
+        except ValueError:
+            raise FilterError('source must be an integer')
+        clauses.append('source_id = %s')
+    date_clauses, date_values = date_filters(params)
+    return clauses + date_clauses, values + date_values
+
+
+def date_filters(params):
+    """Returns a tuple of (list of SQL WHERE clauses, list of params) to filter TaxonLocation
+    objects on an inclusive range of collected_date, using the optional request parameters
+    `date_from` and `date_to` (YYYY-MM-DD). Raises FilterError for invalid dates.
+    """
+    clauses = []
+    values = []
+    if params.get('date_from'):
+        clauses.append('collected_date >= %s')
+        values.append(parse_date(params['date_from'], 'date_from'))
+    if params.get('date_to'):
+        clauses.append('collected_date <= %s')
+        values.append(parse_date(params['date_to'], 'date_to'))
+    return clauses, values
+
+
+def normalise_params(params, keys):
+    """Returns a tuple of sorted (key, value) pairs of the passed-in keys having non-empty values
+    in a dict of request parameters, suitable for use in a cache key.
+    """
+    return tuple(sorted((k, params[k].strip()) for k in keys if params.get(k, '').strip()))
+
+
+def parse_bbox(value):
+    """Parse a bounding box string `minx,miny,maxx,maxy` (GDA94 lon/lat) into a tuple of floats.
+    """
+    try:
+        bbox = tuple(float(i) for i in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise FilterError('bbox must be in the format minx,miny,maxx,maxy')
+    return bbox
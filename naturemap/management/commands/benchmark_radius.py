@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+import random
+from time import perf_counter
+from naturemap.views import RADIUS_SQL
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks TaxonLocation radius queries against a synthetic dataset, with and without the geography index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', action='store', type=int, default=2000000, dest='rows',
+            help='Number of synthetic points to generate (default 2000000)')
+        parser.add_argument(
+            '--queries', action='store', type=int, default=20, dest='queries',
+            help='Number of radius queries to run (default 20)')
+        parser.add_argument(
+            '--radius', action='store', type=float, default=5000.0, dest='radius',
+            help='Query radius in metres (default 5000)')
+
+    def run_queries(self, cursor, sql, centres, radius):
+        start = perf_counter()
+        matches = 0
+        for lon, lat in centres:
+            cursor.execute(sql, (lon, lat, radius))
+            matches += len(cursor.fetchall())
+        return (perf_counter() - start) / len(centres), matches
+
+    def handle(self, *args, **options):
+        rows, radius = options['rows'], options['radius']
+        random.seed(0)
+        # Random query centres within the extent of Western Australia.
+        centres = [(random.uniform(113, 129), random.uniform(-35, -14)) for i in range(options['queries'])]
+        # The query used by TaxonLocationAreaAPI, against the synthetic table.
+        sql = 'SELECT id FROM bench_taxonlocation WHERE {}'.format(RADIUS_SQL)
+
+        # Everything happens in a temporary table inside a transaction that is rolled back.
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.stdout.write('Generating {} synthetic points'.format(rows))
+            cursor.execute('SELECT setseed(0)')
+            cursor.execute('CREATE TEMPORARY TABLE bench_taxonlocation (id serial PRIMARY KEY, point geometry(Point, 4283))')
+            cursor.execute(
+                """INSERT INTO bench_taxonlocation (point)
+                SELECT ST_SetSRID(ST_MakePoint(113 + random() * 16, -35 + random() * 21), 4283)
+                FROM generate_series(1, %s)""", (rows,))
+            cursor.execute('ANALYZE bench_taxonlocation')
+
+            avg, matches = self.run_queries(cursor, sql, centres, radius)
+            self.stdout.write('Without index: {:.1f} ms/query ({} matches)'.format(avg * 1000, matches))
+
+            start = perf_counter()
+            cursor.execute('CREATE INDEX ON bench_taxonlocation USING GIST (geography(point))')
+            cursor.execute('ANALYZE bench_taxonlocation')
+            self.stdout.write('Index built in {:.2f} sec'.format(perf_counter() - start))
+
+            avg, matches = self.run_queries(cursor, sql, centres, radius)
+            self.stdout.write('With index: {:.1f} ms/query ({} matches)'.format(avg * 1000, matches))
+
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, centres[0] + (radius,))
+            self.stdout.write('\n'.join(row[0] for row in cursor.fetchall()))
+            transaction.set_rollback(True)
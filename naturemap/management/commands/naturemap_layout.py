@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+import json
+from time import perf_counter
+from naturemap.views import RADIUS_SQL
+
+
+# Physical orderings available for the table, as the index expression to CLUSTER on.
+ORDERINGS = {
+    'spatial': None,  # Uses the GiST index on point.
+    'geohash': 'ST_GeoHash(point, 10)',
+    'date': 'collected_date',
+}
+SPATIAL_INDEX = 'naturemap_taxonlocation_point_id'
+TEMP_INDEX = 'naturemap_taxonlocation_layout_tmp'
+
+
+class Command(BaseCommand):
+    help = (
+        'Rewrites naturemap_taxonlocation in a physical order (spatial, geohash or collected date) '
+        'and reports the buffers used by the standard API queries before and after. CLUSTER takes '
+        'an exclusive lock on the table, so run this outside of business hours.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--order', action='store', choices=sorted(ORDERINGS), default=None, dest='order',
+            help='Physical order to rewrite the table in (omit to only report)')
+        parser.add_argument(
+            '--date-from', action='store', default='2000-01-01', dest='date_from',
+            help='Start of the date range used by the collected date query (default 2000-01-01)')
+        parser.add_argument(
+            '--date-to', action='store', default='2004-12-31', dest='date_to',
+            help='End of the date range used by the collected date query (default 2004-12-31)')
+
+    def standard_queries(self, cursor, options):
+        """Returns a list of (label, SQL, params) for the standard API queries, using sample
+        values from the table.
+        """
+        cursor.execute(
+            """SELECT ST_X(point), ST_Y(point) FROM naturemap_taxonlocation
+            WHERE id >= (SELECT (min(id) + max(id)) / 2 FROM naturemap_taxonlocation) ORDER BY id LIMIT 1""")
+        row = cursor.fetchone()
+        if not row:
+            raise CommandError('naturemap_taxonlocation is empty')
+        lon, lat = row
+        cursor.execute('SELECT name FROM naturemap_taxonname ORDER BY occurrences DESC LIMIT 1')
+        row = cursor.fetchone()
+        if not row:
+            raise CommandError(
+                'naturemap_taxonname is empty; run naturemap.utils.refresh_taxon_names() to refresh it')
+        name = row[0]
+        return [
+            ('Name', """SELECT id, ST_X(point), ST_Y(point), name FROM naturemap_taxonlocation
+                WHERE effective_to IS NULL AND name ILIKE %s ORDER BY id LIMIT 1000""", ['{}%'.format(name)]),
+            ('Radius (10 km)', 'SELECT id, ST_X(point), ST_Y(point), name FROM naturemap_taxonlocation WHERE {}'.format(
+                RADIUS_SQL), [lon, lat, 10000]),
+            ('Bbox (1 degree)', """SELECT id, ST_X(point), ST_Y(point), name FROM naturemap_taxonlocation
+                WHERE effective_to IS NULL AND point && ST_MakeEnvelope(%s, %s, %s, %s, 4283)""",
+                [lon - 0.5, lat - 0.5, lon + 0.5, lat + 0.5]),
+            ('Collected date', """SELECT id, ST_X(point), ST_Y(point), name FROM naturemap_taxonlocation
+                WHERE effective_to IS NULL AND collected_date >= %s AND collected_date <= %s""",
+                [options['date_from'], options['date_to']]),
+        ]
+
+    def report(self, cursor, queries, heading):
+        self.stdout.write(heading)
+        for label, sql, params in queries:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            top = plan[0]['Plan']
+            self.stdout.write('  {}: {} rows, {} buffer hits, {} buffer reads, {:.1f} ms'.format(
+                label, top['Actual Rows'], top.get('Shared Hit Blocks', 0), top.get('Shared Read Blocks', 0),
+                plan[0]['Execution Time']))
+        cursor.execute(
+            """SELECT correlation FROM pg_stats
+            WHERE tablename = 'naturemap_taxonlocation' AND attname = 'collected_date'""")
+        row = cursor.fetchone()
+        if row:
+            # BRIN indexes are only effective where the physical order correlates with the column.
+            self.stdout.write('  collected_date physical order correlation: {:.2f}'.format(row[0]))
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            queries = self.standard_queries(cursor, options)
+            self.report(cursor, queries, 'Before:')
+            if not options['order']:
+                return
+
+            start = perf_counter()
+            self.stdout.write('Clustering table in {} order'.format(options['order']))
+            expression = ORDERINGS[options['order']]
+            if expression:
+                cursor.execute('CREATE INDEX {} ON naturemap_taxonlocation ({})'.format(TEMP_INDEX, expression))
+                cursor.execute('CLUSTER naturemap_taxonlocation USING {}'.format(TEMP_INDEX))
+                cursor.execute('DROP INDEX {}'.format(TEMP_INDEX))
+            else:
+                cursor.execute('CLUSTER naturemap_taxonlocation USING {}'.format(SPATIAL_INDEX))
+            cursor.execute('ANALYZE naturemap_taxonlocation')
+            self.stdout.write('Clustered in {:.2f} sec'.format(perf_counter() - start))
+            self.report(cursor, queries, 'After:')
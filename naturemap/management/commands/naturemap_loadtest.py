@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+import random
+from time import perf_counter
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+
+# A large polygon (most of the south-west of Western Australia), to generate slow area queries.
+SLOW_POLYGON = 'POLYGON((114 -35,124 -35,124 -26,114 -26,114 -35))'
+AUTOCOMPLETE_TERMS = ('acac', 'eucal', 'cten', 'banks', 'grev', 'mela', 'hakea', 'verti')
+
+
+class Command(BaseCommand):
+    help = (
+        'Load tests a running Naturemap deployment with a mix of slow area queries and cheap name '
+        'autocomplete queries, and reports latency by request type. Run it against the sync (WSGI) '
+        'and ASGI deployments to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='Base URL of the deployment, e.g. http://localhost:8080')
+        parser.add_argument(
+            '--concurrency', action='store', type=int, default=32, dest='concurrency',
+            help='Number of concurrent clients (default 32)')
+        parser.add_argument(
+            '--duration', action='store', type=float, default=30, dest='duration',
+            help='Test duration in seconds (default 30)')
+        parser.add_argument(
+            '--slow-ratio', action='store', type=float, default=0.2, dest='slow_ratio',
+            help='Proportion of requests which are slow area queries (default 0.2)')
+        parser.add_argument(
+            '--timeout', action='store', type=float, default=60, dest='timeout',
+            help='Request timeout in seconds (default 60)')
+
+    def request(self, base_url, slow, timeout):
+        if slow:
+            kind, params = 'area', {'poly': SLOW_POLYGON, 'limit': 10000}
+            url = '{}/naturemap/api/area/?{}'.format(base_url, urlencode(params))
+        else:
+            kind, params = 'autocomplete', {'q': random.choice(AUTOCOMPLETE_TERMS)}
+            url = '{}/naturemap/api/name/?{}'.format(base_url, urlencode(params))
+        start = perf_counter()
+        try:
+            with urlopen(url, timeout=timeout) as resp:
+                resp.read()
+                status = resp.status
+        except HTTPError as e:
+            status = e.code
+        except (URLError, OSError):
+            status = None
+        return kind, status, perf_counter() - start
+
+    def client(self, base_url, deadline, slow_ratio, timeout):
+        results = []
+        while perf_counter() < deadline:
+            results.append(self.request(base_url, random.random() < slow_ratio, timeout))
+        return results
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        start = perf_counter()
+        deadline = start + options['duration']
+        self.stdout.write('Load testing {} with {} clients for {:.0f} sec'.format(
+            base_url, options['concurrency'], options['duration']))
+
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            futures = [
+                executor.submit(self.client, base_url, deadline, options['slow_ratio'], options['timeout'])
+                for i in range(options['concurrency'])
+            ]
+            results = [r for f in futures for r in f.result()]
+        elapsed = perf_counter() - start
+
+        for kind in ('autocomplete', 'area'):
+            latencies = sorted(t for k, s, t in results if k == kind and s == 200)
+            errors = len([s for k, s, t in results if k == kind and s != 200])
+            if not latencies:
+                self.stdout.write('{}: no successful requests, {} errors'.format(kind, errors))
+                continue
+
+            def pct(p):
+                return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+            self.stdout.write('{}: {} ok, {} errors, {:.1f} req/sec, p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms'.format(
+                kind, len(latencies), errors, len(latencies) / elapsed, pct(0.5), pct(0.95), pct(0.99)))
@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from naturemap.utils import import_naturemap_data
+
+
+class Command(BaseCommand):
+    help = 'Syncs Naturemap data from a CSV extract, applying only the changes since the last import'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the Naturemap CSV extract')
+        parser.add_argument(
+            '--batch-size', action='store', type=int, default=10000, dest='batch_size',
+            help='Number of CSV rows per batch (default 10000)')
+        parser.add_argument(
+            '--processes', action='store', type=int, default=None, dest='processes',
+            help='Number of worker processes (default: number of CPUs)')
+        parser.add_argument(
+            '--user', action='store', type=int, default=1, dest='user_id',
+            help='User ID to record as the creator/modifier of changed objects (default 1)')
+
+    def handle(self, *args, **options):
+        import_naturemap_data(
+            options['path'], batch_size=options['batch_size'], processes=options['processes'],
+            user=get_user_model().objects.get(pk=options['user_id']), sync=True)
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('naturemap', '0002_auto_20200629_0812'),
+    ]
+
+    operations = [
+        # Functional index so that radius queries on geography(point) can use a spatial index.
+        migrations.RunSQL(
+            'CREATE INDEX naturemap_taxonlocation_point_geog_idx ON naturemap_taxonlocation USING GIST (geography(point));',
+            reverse_sql='DROP INDEX naturemap_taxonlocation_point_geog_idx;',
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nomenclature', '0001_initial'),
+        ('naturemap', '0003_taxonlocation_point_geography_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """CREATE MATERIALIZED VIEW naturemap_taxonname AS
+            SELECT name, count(*)::integer AS occurrences, max(published_name_id) AS published_name_id,
+                max(supra) AS supra, max(family) AS family, max(kingdom) AS kingdom, max(vernacular) AS vernacular
+            FROM naturemap_taxonlocation
+            WHERE effective_to IS NULL
+            GROUP BY name;
+            CREATE UNIQUE INDEX naturemap_taxonname_name_idx ON naturemap_taxonname (name);
+            CREATE INDEX naturemap_taxonname_name_trgm_idx ON naturemap_taxonname USING GIN (name gin_trgm_ops);
+            CREATE INDEX naturemap_taxonname_name_prefix_idx ON naturemap_taxonname (lower(name) text_pattern_ops);""",
+            reverse_sql='DROP MATERIALIZED VIEW naturemap_taxonname;',
+        ),
+        migrations.CreateModel(
+            name='TaxonName',
+            fields=[
+                ('name', models.CharField(max_length=512, primary_key=True, serialize=False)),
+                ('occurrences', models.IntegerField()),
+                ('supra', models.CharField(blank=True, max_length=64, null=True)),
+                ('family', models.CharField(blank=True, max_length=64, null=True)),
+                ('kingdom', models.CharField(blank=True, max_length=64, null=True)),
+                ('vernacular', models.CharField(blank=True, max_length=256, null=True)),
+                ('published_name', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='nomenclature.Name')),
+            ],
+            options={
+                'db_table': 'naturemap_taxonname',
+                'managed': False,
+            },
+        ),
+    ]
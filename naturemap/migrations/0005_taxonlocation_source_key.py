@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('naturemap', '0004_taxonname'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxonlocation',
+            name='source_key',
+            field=models.CharField(blank=True, help_text='The stable identifier of this record in its source.', max_length=256, null=True),
+        ),
+        migrations.AddField(
+            model_name='taxonlocation',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the source record content, used to detect changes when syncing.', max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='taxonlocation',
+            index=models.Index(fields=['source', 'source_key'], name='naturemap_t_source__fcc086_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('naturemap', '0005_taxonlocation_source_key'),
+    ]
+
+    operations = [
+        # Pre-aggregated facet counts per source (source_id 0 means no source).
+        migrations.RunSQL(
+            """CREATE MATERIALIZED VIEW naturemap_taxonlocationfacet AS
+            SELECT source_id,
+                CASE GROUPING(supra, family, kingdom, conservation_status)
+                    WHEN 7 THEN 'supra' WHEN 11 THEN 'family' WHEN 13 THEN 'kingdom'
+                    WHEN 14 THEN 'conservation_status' ELSE 'total' END AS field,
+                COALESCE(supra, family, kingdom, conservation_status, '') AS value,
+                count(*)::integer AS count
+            FROM (
+                SELECT COALESCE(source_id, 0) AS source_id, COALESCE(supra, '') AS supra,
+                    COALESCE(family, '') AS family, COALESCE(kingdom, '') AS kingdom,
+                    COALESCE(conservation_status, '') AS conservation_status
+                FROM naturemap_taxonlocation
+                WHERE effective_to IS NULL
+            ) AS t
+            GROUP BY source_id, GROUPING SETS ((supra), (family), (kingdom), (conservation_status), ());
+            CREATE UNIQUE INDEX naturemap_taxonlocationfacet_idx ON naturemap_taxonlocationfacet (source_id, field, value);""",
+            reverse_sql='DROP MATERIALIZED VIEW naturemap_taxonlocationfacet;',
+        ),
+    ]
@@ -0,0 +1,16 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('naturemap', '0006_taxonlocationfacet'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taxonlocation',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['collected_date'], name='naturemap_t_collect_30f819_brin'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('naturemap', '0007_taxonlocation_collected_date_brin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taxonlocation',
+            index=models.Index(condition=models.Q(effective_to__isnull=True), fields=['collected_date'], name='naturemap_t_collected_date_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import BrinIndex
 from nomenclature.models import Name
+from waherb.cache import invalidate_on_change
 from waherb.utils import AuditMixin, ActiveMixin
 
 
@@ -63,7 +65,48 @@ class TaxonLocation(AuditMixin, ActiveMixin):
     survey = models.CharField(
         max_length=256, help_text='The name of the survey during which this taxon sample was collected.')
     source = models.ForeignKey(Source, on_delete=models.PROTECT, blank=True, null=True)
+    source_key = models.CharField(
+        max_length=256, blank=True, null=True, help_text='The stable identifier of this record in its source.')
+    content_hash = models.CharField(
+        max_length=32, blank=True, null=True, editable=False,
+        help_text='Hash of the source record content, used to detect changes when syncing.')
     metadata = JSONField(default=dict, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'source_key']),
+            BrinIndex(fields=['collected_date'], autosummarize=True),
+            # B-tree index for date range filters, which is effective whatever the physical order.
+            models.Index(
+                fields=['collected_date'], name='naturemap_t_collected_date_idx',
+                condition=models.Q(effective_to__isnull=True)),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+# Invalidate cached Naturemap API responses whenever TaxonLocation data changes.
+invalidate_on_change(TaxonLocation, 'naturemap')
+
+
+class TaxonName(models.Model):
+    """This model represents a distinct taxon name in the current TaxonLocation data, with the count
+    of occurrences. It is backed by a materialised view (not managed by Django), which is used for
+    fast name autocomplete queries and must be refreshed after TaxonLocation data is imported
+    (see utils.refresh_taxon_names).
+    """
+    name = models.CharField(max_length=512, primary_key=True)
+    occurrences = models.IntegerField()
+    published_name = models.ForeignKey(Name, on_delete=models.DO_NOTHING, blank=True, null=True)
+    supra = models.CharField(max_length=64, blank=True, null=True)
+    family = models.CharField(max_length=64, blank=True, null=True)
+    kingdom = models.CharField(max_length=64, blank=True, null=True)
+    vernacular = models.CharField(max_length=256, blank=True, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'naturemap_taxonname'
+
     def __str__(self):
         return self.name
@@ -65,11 +65,8 @@ L.control.layers(baseMaps, overlayMaps).addTo(map);
 // Define scale bar
 L.control.scale({maxWidth: 500, imperial: false}).addTo(map);
 
-// Add a feature group to the map to contain sample markers.
-//var samples = new L.featureGroup();
-var samples = new L.markerClusterGroup({
-  maxClusterRadius: 50,
-});
+// Add a feature group to the map to contain sample cluster markers.
+var samples = new L.featureGroup();
 map.addLayer(samples);
 
 // Function to generate WKT from a Leaflet layer.
@@ -107,27 +104,24 @@ function toWKT (layer) {
   }
 }
 
-// Global variable to store API response data.
-var ids;
+// Vector tile layer of sample points for a name search, rendered from the tile endpoint so
+// that the browser never has to receive every matching point.
+var nameTiles;
 
-// Function to draw passed-in array of points on the samples feature group.
-var mapSamples = function(data) {
-  ids = [];
+var mapNameTiles = function(name) {
   samples.clearLayers();
-  // Iterate through the array and add markers for each point.
-  data.forEach((element) => {
-    ids.push(element.id);
-    var marker = L.marker(
-        // Leaflet.marker wants coords as LatLon (Y,X) :\
-        [element.lat, element.lon],
-      {
-        title: element.name,
-        clickable: false,
-      }
-    );
-    marker.addTo(samples);
-  });
-  map.fitBounds(samples.getBounds());
+  if (nameTiles) {
+    map.removeLayer(nameTiles);
+  }
+  nameTiles = L.vectorGrid.protobuf(
+    "/naturemap/tiles/{z}/{x}/{y}.mvt?crs=4326&name=" + encodeURIComponent(name),
+    {
+      vectorTileLayerStyles: {
+        taxonlocation: {radius: 4, weight: 1, color: "#3388ff", fill: true, fillOpacity: 0.6},
+      },
+    },
+  );
+  nameTiles.addTo(map);
 };
 
 // Add a feature group to store drawn features.
@@ -154,10 +148,45 @@ var drawControl = new L.Control.Draw({
 });
 map.addControl(drawControl);
 
+// Parameters of the current area search (null if none).
+var areaSearch = null;
+
+// Function to draw passed-in array of grid clusters (from the aggregate API) on the samples
+// feature group, as circle markers sized by count.
+var mapClusters = function(data) {
+  samples.clearLayers();
+  data.forEach((element) => {
+    var marker = L.circleMarker(
+      [element.lat, element.lon],
+      {radius: Math.min(6 + Math.log2(element.count) * 2, 30), weight: 1},
+    );
+    marker.bindTooltip(element.count === 1 ? element.name : `${element.count} samples`);
+    marker.addTo(samples);
+  });
+};
+
+// Function to query clusters for the current area search within the visible map extent.
+var queryArea = function() {
+  var params = Object.assign({aggregate: 'grid', zoom: map.getZoom(), bbox: map.getBounds().toBBoxString()}, areaSearch);
+  $.getJSON("/naturemap/api/area/", params, function(data) {
+    var total = data.reduce((sum, element) => sum + element.count, 0);
+    $("div#api-response").html(`<p>${total} results in view</p>`);
+    mapClusters(data);
+    if (total > 0) {
+      $('#download-button').data('search', 'area');
+      $('#download-button').prop('disabled', false);
+    }
+  });
+};
+
 map.on(L.Draw.Event.CREATED, function (e) {
   $("div#api-response").html("<p>Querying database...</p>");
   $('#download-button').prop('disabled', true);
   drawnItems.clearLayers();
+  if (nameTiles) {
+    map.removeLayer(nameTiles);
+    nameTiles = null;
+  }
   var type = e.layerType, layer = e.layer;
   if (type === 'circle') {
     let point = `${layer._latlng.lng},${layer._latlng.lat}`;
@@ -166,26 +195,19 @@ map.on(L.Draw.Event.CREATED, function (e) {
       alert('NOTE: search radius will be limited to 20 km from origin');
       radius = 20000;
     }
-    $.getJSON("/naturemap/api/area/", {point: point, r: radius}, function(data) {
-      $("div#api-response").html(`<p>${data.length} results returned</p>`);
-      if (data.length > 0) {
-        mapSamples(data);
-        $('#download-button').data('search', 'area');
-        $('#download-button').prop('disabled', false);
-      }
-    });
+    areaSearch = {point: point, r: radius};
   } else if (type === 'polygon' || type === 'rectangle') {
-    let poly = toWKT(layer);
-    $.getJSON("/naturemap/api/area/", {poly: poly}, function(data) {
-      $("div#api-response").html(`<p>${data.length} results returned</p>`);
-      if (data.length > 0) {
-        mapSamples(data);
-        $('#download-button').data('search', 'area');
-        $('#download-button').prop('disabled', false);
-      }
-    });
+    areaSearch = {poly: toWKT(layer)};
   }
   drawnItems.addLayer(layer);
+  queryArea();
+});
+
+// Cluster sizes depend upon the zoom level, so re-query the area search when the map moves.
+map.on('moveend', function() {
+  if (areaSearch) {
+    queryArea();
+  }
 });
 
 // Document onready events
@@ -203,7 +225,7 @@ $(function() {
           return;
       }
       $.getJSON("/naturemap/api/name/", {q: request.term}, function(data) {
-        data = data.sort();
+        // Suggestions are returned ranked by number of occurrences.
         cache[term] = data;
         resp(data);
       })
@@ -215,14 +237,12 @@ $(function() {
     $('#download-button').prop('disabled', true);
     $("div#api-response").html("<p>Querying database...</p>");
     var name = $("input#species-name").val();
-    $.getJSON("/naturemap/api/name/", {name: name}, function(data) {
-      $("div#api-response").html(`<p>${data.length} results returned</p>`);
-      if (data.length > 0) {
-        mapSamples(data);
-        $('#download-button').data('search', 'name');
-        $('#download-button').prop('disabled', false);
-      }
-    });
+    areaSearch = null;
+    drawnItems.clearLayers();
+    mapNameTiles(name);
+    $("div#api-response").html(`<p>Showing results for ${name}</p>`);
+    $('#download-button').data('search', 'name');
+    $('#download-button').prop('disabled', false);
   });
 
   $('#download-button').click(function() {
@@ -232,7 +252,7 @@ $(function() {
       window.open("/naturemap/api/name/?download=&name=" + name);
     } else if ($('#download-button').data('search') === 'area') {
       // We searched on area.
-      window.open("/naturemap/api/area/?download=&ids=" + ids.join(","));
+      window.open("/naturemap/api/area/?download=&" + $.param(areaSearch));
     }
   });
 
@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.db import connection
+import hashlib
+import os
+import shutil
+from waherb.cache import get_cache
+from .filters import FILTER_PARAMS, normalise_params, taxon_filters
+
+
+# Tile grids supported by the tile endpoint: SRID -> (origin x, origin y, tile width at zoom 0,
+# number of tile columns at zoom 0).
+# 3857 is the standard web mercator XYZ scheme; 4326 is the lat/lon grid used by Leaflet's
+# L.CRS.EPSG4326 (two 180 degree tiles at zoom 0), as used by the Naturemap page.
+TILE_GRIDS = {
+    3857: (-20037508.342789244, 20037508.342789244, 2 * 20037508.342789244, 1),
+    4326: (-180.0, 90.0, 180.0, 2),
+}
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_LAYER = 'taxonlocation'
+# API cache key holding the number of tiles in the disk cache.
+TILE_COUNT_KEY = 'naturemap_tile_cache_files'
+
+
+def tile_bounds(z, x, y, srid=3857):
+    """Returns the (minx, miny, maxx, maxy) bounds of a tile in the passed-in tile grid, or
+    None if the tile is outside the grid.
+    """
+    origin_x, origin_y, width, columns = TILE_GRIDS[srid]
+    size = width / 2 ** z
+    if z < 0 or z > 24 or x < 0 or y < 0 or x >= columns * 2 ** z or y >= 2 ** z:
+        return None
+    minx = origin_x + x * size
+    maxy = origin_y - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def render_tile(z, x, y, srid, params):
+    """Renders a Mapbox Vector Tile of the TaxonLocation points within a tile, filtered by the
+    passed-in request parameters (see filters.taxon_filters). Returns the tile as bytes.
+    """
+    bounds = tile_bounds(z, x, y, srid)
+    clauses, values = taxon_filters(params)
+    sql = """WITH bounds AS (SELECT ST_MakeEnvelope(%s, %s, %s, %s, {srid}) AS geom)
+        SELECT ST_AsMVT(tile, %s, %s, 'geom') FROM (
+            SELECT t.id, t.name, ST_AsMVTGeom(ST_Transform(t.point, {srid}), bounds.geom, %s, %s, true) AS geom
+            FROM naturemap_taxonlocation t, bounds
+            WHERE t.point && ST_Transform(bounds.geom, 4283) AND {where}
+        ) AS tile""".format(srid=srid, where=' AND '.join(clauses))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(bounds) + [TILE_LAYER, TILE_EXTENT, TILE_EXTENT, TILE_BUFFER] + values)
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile else b''
+
+
+def tile_cache_path(z, x, y, srid, params):
+    """Returns the path of a cached tile. Tiles are cached under a directory per source
+    (or 'all'), then a directory per unique combination of the other filter parameters.
+    """
+    key = normalise_params(params, FILTER_PARAMS)
+    source = dict(key).get('source')
+    source_dir = 'source_{}'.format(source) if source else 'all'
+    digest = hashlib.sha1(repr((srid, key)).encode('utf-8')).hexdigest()
+    return os.path.join(settings.NATUREMAP_TILE_CACHE, source_dir, digest, str(z), str(x), '{}.mvt'.format(y))
+
+
+def tile_cacheable(params):
+    """Returns True if tiles for the passed-in request parameters may be cached on disk: the
+    name, supra, family and kingdom filters must match a TaxonName object, the source must be a
+    current Source and there must be no date filters. This bounds the number of cached tile
+    sets by the data, rather than by the parameters that clients send (see also get_tile).
+    """
+    key = dict(normalise_params(params, FILTER_PARAMS))
+    if 'date_from' in key or 'date_to' in key:
+        return False
+    checks = []
+    values = []
+    fields = [f for f in ('name', 'supra', 'family', 'kingdom') if f in key]
+    if fields:
+        checks.append('EXISTS (SELECT 1 FROM naturemap_taxonname WHERE {})'.format(
+            ' AND '.join('{} = %s'.format(f) for f in fields)))
+        values += [key[f] for f in fields]
+    if 'source' in key:
+        if not key['source'].isdigit():
+            return False
+        checks.append('EXISTS (SELECT 1 FROM naturemap_source WHERE id = %s AND effective_to IS NULL)')
+        values.append(int(key['source']))
+    if not checks:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT {}'.format(' AND '.join(checks)), values)
+        return cursor.fetchone()[0]
+
+
+def tile_cache_count():
+    """Returns the number of tiles in the disk cache. The count is kept in the API cache, and
+    recounted from the disk if it is missing.
+    """
+    cache = get_cache()
+    count = cache.get(TILE_COUNT_KEY)
+    if count is None:
+        count = sum(len(files) for _, _, files in os.walk(settings.NATUREMAP_TILE_CACHE))
+        cache.set(TILE_COUNT_KEY, count, timeout=None)
+    return count
+
+
+def get_tile(z, x, y, srid, params):
+    """Returns a tile from the disk cache, or renders it. Rendered tiles are only cached if they
+    aren't empty, are at or below settings.NATUREMAP_TILE_CACHE_MAX_ZOOM, match tile_cacheable,
+    and the cache holds fewer than settings.NATUREMAP_TILE_CACHE_MAX_FILES tiles. Uncached tiles
+    rely on HTTP caching only.
+    """
+    path = tile_cache_path(z, x, y, srid, params)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    tile = render_tile(z, x, y, srid, params)
+    if not tile or z > settings.NATUREMAP_TILE_CACHE_MAX_ZOOM:
+        return tile
+    if tile_cache_count() >= settings.NATUREMAP_TILE_CACHE_MAX_FILES or not tile_cacheable(params):
+        return tile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first, so that a partial tile is never served.
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(tile)
+    os.replace(tmp, path)
+    try:
+        get_cache().incr(TILE_COUNT_KEY)
+    except ValueError:  # The count was evicted; it will be recounted.
+        pass
+    return tile
+
+
+def invalidate_tile_cache(source_id=None):
+    """Remove cached tiles for a source (plus the tiles for all sources), or all cached tiles
+    if no source is passed in. Call this whenever TaxonLocation data is re-imported.
+    """
+    if source_id is None:
+        dirs = [settings.NATUREMAP_TILE_CACHE]
+    else:
+        dirs = [
+            os.path.join(settings.NATUREMAP_TILE_CACHE, 'source_{}'.format(source_id)),
+            os.path.join(settings.NATUREMAP_TILE_CACHE, 'all'),
+        ]
+    for d in dirs:
+        shutil.rmtree(d, ignore_errors=True)
+    get_cache().delete(TILE_COUNT_KEY)
@@ -1,10 +1,16 @@
 from django.urls import path
-from .views import TaxonLocationSearch, TaxonLocationNameAPI, TaxonLocationAreaAPI
+from .views import (
+    TaxonLocationSearch, TaxonLocationNameAPI, TaxonLocationAreaAPI, TaxonLocationFacetAPI, TaxonLocationHistogramAPI,
+    TaxonLocationTileAPI,
+)
 
 
 app_name = 'crossreference'
 urlpatterns = [
     path('naturemap/api/name/', TaxonLocationNameAPI.as_view(), name='api_taxonlocation_name'),
     path('naturemap/api/area/', TaxonLocationAreaAPI.as_view(), name='api_taxonlocation_area'),
+    path('naturemap/api/facets/', TaxonLocationFacetAPI.as_view(), name='api_taxonlocation_facets'),
+    path('naturemap/api/histogram/', TaxonLocationHistogramAPI.as_view(), name='api_taxonlocation_histogram'),
+    path('naturemap/tiles/<int:z>/<int:x>/<int:y>.mvt', TaxonLocationTileAPI.as_view(), name='taxonlocation_tile'),
     path('naturemap/', TaxonLocationSearch.as_view(), name='taxonlocation_search'),
 ]
@@ -1,42 +1,279 @@
 import csv
-from datetime import datetime
+import hashlib
+from datetime import date
 from django.contrib.gis.geos import GEOSGeometry
-from .models import TaxonLocation
+from django.db import connection, transaction
+from io import StringIO
+import re
+import struct
+from time import perf_counter
+import uuid
+from waherb.cache import bump_version
+from waherb.loaders import copy_value, parallel_copy, read_batches
+from waherb.utils import get_current_user
+from .facets import refresh_facet_rollup
+from .models import Source, TaxonLocation
+from .tiles import invalidate_tile_cache
 
 
-def import_naturemap_data(path='nmpspecies.csv'):
-    f = open(path, 'r')
-    reader = csv.reader(f)
-    print(next(reader))
-    count = 0
-    then = datetime.now()
+# Name of the staging table used by an import (each run uses its own table).
+STAGING_TABLE = 'naturemap_staging_{}'
+# Columns of the Naturemap CSV extract, in order. These are followed by the source name and
+# (optionally) the stable identifier of the record in that source.
+CSV_COLUMNS = (
+    'name', 'point', 'supra', 'family', 'kingdom', 'conservation_status', 'vernacular', 'collector',
+    'collected_date', 'survey',
+)
+# Columns used to derive a source key for rows which don't have one (see _source_key).
+KEY_COLUMNS = ('name', 'point', 'collector', 'collected_date', 'survey')
+# Columns of the staging table, in COPY order.
+STAGING_COLUMNS = CSV_COLUMNS + ('source', 'source_key', 'content_hash')
+# Columns copied from the staging table to naturemap_taxonlocation.
+LOAD_COLUMNS = CSV_COLUMNS + ('source_key', 'content_hash')
+# The maximum length of each text column of the staging table (and naturemap_taxonlocation).
+FIELD_MAX_LENGTHS = {c: TaxonLocation._meta.get_field(c).max_length for c in (
+    'name', 'supra', 'family', 'kingdom', 'conservation_status', 'vernacular', 'collector', 'survey', 'source_key')}
+FIELD_MAX_LENGTHS['source'] = Source._meta.get_field('name').max_length
+WKT_POINT_RE = re.compile(r'^\s*(?:SRID=\d+;)?\s*POINT\s*\(\s*(\S+)\s+(\S+)\s*\)\s*$', re.IGNORECASE)
+
+
+def point_ewkb(wkt, srid=4283):
+    """Convert a WKT point to hex-encoded EWKB. Simple `POINT (x y)` strings are packed directly,
+    which is much faster than parsing them with GEOS; anything else falls back to GEOSGeometry.
+    """
+    match = WKT_POINT_RE.match(wkt)
+    if match:
+        try:
+            # Little-endian point with SRID flag set (0x20000000).
+            return struct.pack('<BIIdd', 1, 0x20000001, srid, float(match.group(1)), float(match.group(2))).hex()
+        except ValueError:
+            pass
+    geom = GEOSGeometry(wkt, srid=srid)
+    geom.srid = srid
+    return geom.hexewkb.decode()
+
+
+def _source_key(row):
+    """Returns the stable source key for a CSV row: the source record identifier column if
+    present, otherwise a hash of the columns which identify an occurrence. Rows sharing a key
+    within a source are given an ordinal once staged (see _number_duplicates).
+    """
+    if len(row) > len(CSV_COLUMNS) + 1 and row[len(CSV_COLUMNS) + 1].strip():
+        return row[len(CSV_COLUMNS) + 1].strip()
+    values = dict(zip(CSV_COLUMNS, row))
+    return hashlib.md5('\x1f'.join(values[c] for c in KEY_COLUMNS).encode('utf-8')).hexdigest()
+
+
+def _parse_naturemap_rows(rows):
+    """Worker function: parse a batch of Naturemap CSV records (lists of field values) and return
+    a tuple of (COPY text buffer, row count, list of rejected records). Records which can't be
+    parsed, or have a value too long for its column, are rejected. Runs inside a process pool,
+    so it must not touch the database.
+    """
+    out = []
+    rejected = []
+    for row in rows:
+        if not any(field.strip() for field in row):
+            continue
+        try:
+            values = dict(zip(CSV_COLUMNS, row))
+            values['source'] = row[len(CSV_COLUMNS)]
+            values['source_key'] = _source_key(row)
+            values['content_hash'] = hashlib.md5('\x1f'.join(row[:len(CSV_COLUMNS) + 1]).encode('utf-8')).hexdigest()
+            values['point'] = point_ewkb(values['point'])
+            values['collected_date'] = date.fromisoformat(values['collected_date']) if values['collected_date'] else None
+        except (IndexError, ValueError, TypeError):
+            rejected.append(','.join(row))
+            continue
+        overlong = [f for f, length in FIELD_MAX_LENGTHS.items() if len(values[f] or '') > length]
+        if overlong:
+            rejected.append('{} longer than allowed: {}'.format(', '.join(overlong), ','.join(row)))
+            continue
+        out.append('\t'.join(copy_value(values[c]) for c in STAGING_COLUMNS) + '\n')
+    return ''.join(out), len(out), rejected
+
+
+def _number_duplicates(table):
+    """Make the source keys in the staging table unique within each source, by appending an
+    occurrence ordinal (`#2`, `#3`, ...) to the second and later rows sharing a key, ordered by
+    content hash. Genuine duplicate records in an extract (e.g. identical occurrences without a
+    source identifier) are therefore all loaded, and match the same rows on every sync.
+    Returns the number of keys changed.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """UPDATE {0} stg SET source_key = left(stg.source_key, 256 - length('#' || d.n)) || '#' || d.n
+            FROM (
+                SELECT ctid, row_number() OVER (PARTITION BY source, source_key ORDER BY content_hash) AS n
+                FROM {0}
+            ) d
+            WHERE stg.ctid = d.ctid AND d.n > 1""".format(table))
+        return cursor.rowcount
+
+
+def _staged_sources(table, user):
+    """Returns a dict of {source name: source pk} for each source in the staging table, creating
+    Source objects for any new source names.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT DISTINCT source FROM {}'.format(table))
+        names = [row[0] for row in cursor.fetchall()]
+    sources = dict(Source.objects.current().filter(name__in=names).values_list('name', 'pk'))
+    new = [Source(name=name) for name in names if name not in sources]
+    if new:
+        Source.objects.audited_bulk_create(new, user=user)
+        sources = dict(Source.objects.current().filter(name__in=names).values_list('name', 'pk'))
+    return sources
+
+
+def _replace_staged(table, sources, user):
+    """Replace the TaxonLocation objects for each source in the staging table with the staged rows.
+    """
+    with connection.cursor() as cursor:
+        # Remove the existing objects for each source, including those loaded before objects
+        # were linked to a Source (which recorded the source name in metadata).
+        cursor.execute(
+            """DELETE FROM naturemap_taxonlocation
+            WHERE source_id = ANY(%s) OR (source_id IS NULL AND metadata->>'source' = ANY(%s))""",
+            (list(sources.values()), list(sources.keys())))
+        print('Removed {} existing records'.format(cursor.rowcount))
+        cursor.execute(
+            """INSERT INTO naturemap_taxonlocation (
+                created, modified, creator_id, modifier_id, {0}, source_id, metadata)
+            SELECT now(), now(), %s, %s, {1}, src.id, '{{}}'
+            FROM {2} stg JOIN naturemap_source src ON src.name = stg.source AND src.id = ANY(%s)""".format(
+                ', '.join(LOAD_COLUMNS), ', '.join('stg.{}'.format(c) for c in LOAD_COLUMNS), table),
+            (user.pk, user.pk, list(sources.values())))
+        print('Inserted {} records'.format(cursor.rowcount))
+
+
+def _sync_staged(table, sources, user):
+    """Apply the differences between the staged rows and the current TaxonLocation objects for each
+    source in the staging table, matching rows on source key: rows with a changed content hash are
+    updated, new rows are inserted and current objects missing from the staged rows are
+    soft-deleted. Returns the set of pks of the sources which changed.
+    """
+    # The staged rows (which have unique source keys, see _number_duplicates), with their Source pk.
+    staged = """SELECT stg.*, src.id AS source_id
+        FROM {} stg JOIN naturemap_source src ON src.name = stg.source AND src.id = ANY(%(sources)s)""".format(table)
+    statements = (
+        ('Updated', """UPDATE naturemap_taxonlocation t SET modified = now(), modifier_id = %(user)s, {}
+            FROM staged s
+            WHERE t.source_id = s.source_id AND t.source_key = s.source_key AND t.effective_to IS NULL
+            AND t.content_hash IS DISTINCT FROM s.content_hash
+            RETURNING t.source_id""".format(', '.join('{0} = s.{0}'.format(c) for c in LOAD_COLUMNS))),
+        ('Inserted', """INSERT INTO naturemap_taxonlocation (
+                created, modified, creator_id, modifier_id, {}, source_id, metadata)
+            SELECT now(), now(), %(user)s, %(user)s, {}, s.source_id, '{{}}'
+            FROM staged s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM naturemap_taxonlocation t
+                WHERE t.source_id = s.source_id AND t.source_key = s.source_key AND t.effective_to IS NULL)
+            RETURNING source_id""".format(', '.join(LOAD_COLUMNS), ', '.join('s.{}'.format(c) for c in LOAD_COLUMNS))),
+        ('Soft-deleted', """UPDATE naturemap_taxonlocation t
+            SET effective_to = now(), modified = now(), modifier_id = %(user)s
+            WHERE t.source_id = ANY(%(sources)s) AND t.effective_to IS NULL AND NOT EXISTS (
+                SELECT 1 FROM staged s WHERE s.source_id = t.source_id AND s.source_key = t.source_key)
+            RETURNING t.source_id"""),
+    )
+    params = {'user': user.pk, 'sources': list(sources.values())}
+    changed = set()
+    with connection.cursor() as cursor:
+        for label, sql in statements:
+            # Count the changes per source in the database, rather than returning every row.
+            cursor.execute(
+                """WITH staged AS ({}), changes AS ({}) SELECT source_id, count(*) FROM changes GROUP BY source_id""".format(
+                    staged, sql),
+                params)
+            counts = dict(cursor.fetchall())
+            changed.update(counts)
+            print('{} {} records'.format(label, sum(counts.values())))
+    return changed
+
+
+def import_naturemap_data(path='nmpspecies.csv', batch_size=10000, processes=None, user=None, sync=False, reindex=None):
+    """Utility function to import Naturemap data from a CSV extract (with a header row; quoted
+    fields may span lines). After the Naturemap columns, each row has the name of the data source
+    and optionally the stable identifier of the record in that source; the objects imported are
+    linked to a Source of that name (created as required).
+
+    Records are read in this process, then field parsing and WKT to EWKB conversion are spread
+    across a process pool (see waherb.loaders.parallel_copy), and the parsed rows are written to
+    an unlogged staging table (named for this run, so that concurrent runs don't collide) using
+    COPY. The staging table is then merged into
+    naturemap_taxonlocation in a single transaction, either replacing the existing objects of
+    each source in the extract or, with `sync=True`, applying only the inserts, updates and
+    soft-deletes needed to match the extract (see _sync_staged). Afterwards the table indexes
+    are rebuilt (by default only for a full import), and the table statistics, tile cache, name
+    lookup view and API cache are refreshed for the sources which changed.
+    """
+    if reindex is None:
+        reindex = not sync
+    user = user or get_current_user()
+    table = STAGING_TABLE.format(uuid.uuid4().hex[:16])
+    start = perf_counter()
     print('Starting import of Naturemap data')
-    new_records = []
-
-    for row in reader:
-        new_records.append(TaxonLocation(
-            name=row[0],
-            point=GEOSGeometry(row[1], srid=4283),
-            supra=row[2],
-            family=row[3],
-            kingdom=row[4],
-            conservation_status=row[5],
-            vernacular=row[6],
-            collector=row[7],
-            collected_date=datetime.strptime(row[8], '%Y-%m-%d') if row[8] else None,
-            survey=row[9],
-            metadata={'source': row[10]},
-            creator_id=1,  # Default value, assumes user with ID 1 exists.
-            modifier_id=1,  # Default value, assumes user with ID 1 exists.
-        ))
-        count += 1
-        if count % 1000 == 0:  # Commit our new records to the database.
-            TaxonLocation.objects.bulk_create(new_records)  # bulk_create is WAY faster.
-            new_records = []
-            elapsed = (datetime.now() - then).microseconds
-            print('Processed {} records, {} s/1000 records'.format(count, elapsed / 1000 / 1000))
-            then = datetime.now()
-
-    if new_records:  # Save any remaining records in our list.
-        TaxonLocation.objects.bulk_create(new_records)
-        new_records = []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """CREATE UNLOGGED TABLE {} (
+                name varchar(512), point geometry(Point, 4283), supra varchar(64), family varchar(64),
+                kingdom varchar(64), conservation_status varchar(16), vernacular varchar(256),
+                collector varchar(256), collected_date date, survey varchar(256), source varchar(256),
+                source_key varchar(256), content_hash varchar(32))""".format(
+                table))
+    try:
+        # Don't carry an open database connection into the forked worker processes.
+        connection.close()
+
+        def copy(buf, context):
+            with connection.cursor() as cursor:
+                cursor.copy_expert('COPY {} FROM STDIN'.format(table), StringIO(buf))
+
+        # Records are read with csv.reader in this process, as quoted fields may span lines.
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            print(','.join(next(reader)))  # Header row.
+            batches = ((batch, None) for batch in read_batches(reader, batch_size))
+            count, rejected = parallel_copy(batches, _parse_naturemap_rows, copy, processes)
+        print('Staged {} records ({} rejected) in {:.2f} sec'.format(count, rejected, perf_counter() - start))
+        duplicates = _number_duplicates(table)
+        if duplicates:
+            print('Numbered {} records with duplicate source keys'.format(duplicates))
+
+        with transaction.atomic():
+            sources = _staged_sources(table, user)
+            if sync:
+                with connection.cursor() as cursor:
+                    cursor.execute('CREATE INDEX ON {} (source, source_key)'.format(table))
+                    cursor.execute('ANALYZE {}'.format(table))
+                changed = _sync_staged(table, sources, user)
+            else:
+                _replace_staged(table, sources, user)
+                changed = set(sources.values())
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(table))
+
+    with connection.cursor() as cursor:
+        if reindex:
+            print('Rebuilding indexes')
+            cursor.execute('REINDEX TABLE naturemap_taxonlocation')
+        cursor.execute('ANALYZE naturemap_taxonlocation')
+
+    if changed:
+        for source_id in changed:
+            invalidate_tile_cache(source_id)
+        refresh_taxon_names()
+        refresh_facet_rollup()
+        bump_version('naturemap')
+    elapsed = perf_counter() - start
+    print('Imported {} records in {:.2f} sec, {:.0f} records/sec'.format(count, elapsed, count / max(elapsed, 1e-6)))
+
+
+def refresh_taxon_names():
+    """Refresh the materialised view of distinct taxon names (TaxonName). The view is refreshed
+    concurrently, so autocomplete queries are not blocked while it runs.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY naturemap_taxonname')
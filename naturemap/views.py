@@ -1,47 +1,171 @@
 from datetime import datetime
-from django.core.serializers import serialize
 from django.conf import settings
 from django.db import connection
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.views.generic import View, TemplateView
-from .models import TaxonLocation
+from waherb.cache import cached_response
+from waherb.utils import estimate_sql_count
+from .export import columnar_points, geojson_properties, geojson_response, packed_points
+from .areas import polygon_filter
+from .clusters import grid_clusters, parse_zoom
+from .facets import HISTOGRAM_INTERVALS, date_histogram, facet_counts, rollup_facet_counts
+from .filters import FILTER_PARAMS, FilterError, date_filters, like_escape, parse_bbox, taxon_filters
+from .tiles import get_tile, tile_bounds
+
+
+# Radius query (lon, lat, metres). The geography(point) expression matches the functional GiST
+# index on naturemap_taxonlocation, so it must not be changed independently of that index.
+RADIUS_SQL = 'ST_DWithin(geography(point), ST_SetSRID(ST_MakePoint(%s, %s), 4283)::geography, %s)'
+
+
+def aggregate_response(request, clauses=(), params=()):
+    """Returns a JsonResponse of the grid clusters of TaxonLocation objects matching the passed-in
+    SQL WHERE clauses & params, plus the filters in the request parameters (see
+    filters.taxon_filters). Request parameter `zoom` sets the cluster grid size, and `bbox`
+    (minx,miny,maxx,maxy) optionally limits the results to the visible map extent.
+    """
+    try:
+        zoom = parse_zoom(request.GET.get('zoom'))
+        bbox = parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+        filters, values = taxon_filters(request.GET)
+    except FilterError as e:
+        return HttpResponseBadRequest(str(e))
+    clusters = grid_clusters(filters + list(clauses), values + list(params), zoom, bbox)
+    return JsonResponse(clusters, safe=False)
+
+
+def page_response(request, clauses=(), params=()):
+    """Returns a JsonResponse of one page of the TaxonLocation objects matching the passed-in SQL
+    WHERE clauses & params, plus the filters in the request parameters (see
+    filters.taxon_filters). Objects are ordered by id and paged using keyset pagination:
+    request parameter `after_id` returns objects with an id greater than that value, `limit`
+    sets the page size, `bbox` (minx,miny,maxx,maxy) optionally clips the results and `fields`
+    selects extra properties to return (comma-separated, default `name`).
+
+    Request parameter `format` selects the response encoding: `json` (default, a list of
+    objects), `columnar` (see export.columnar_points) or `binary` (see export.packed_points,
+    names only, with the row count in header `X-Count`).
+
+    The response has a header `X-Total-Estimate` (the planner's estimate of the total number of
+    matching objects) and, if there may be more objects, `X-Next-After-Id` (the `after_id` value
+    to request the next page).
+    """
+    try:
+        after_id = int(request.GET.get('after_id') or 0)
+        limit = int(request.GET.get('limit') or settings.NATUREMAP_API_PAGE_SIZE)
+        bbox = parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+        filters, values = taxon_filters(request.GET)
+    except (FilterError, ValueError) as e:
+        return HttpResponseBadRequest(str(e))
+    limit = max(1, min(limit, settings.NATUREMAP_API_MAX_PAGE_SIZE))
+    clauses = filters + list(clauses)
+    params = values + list(params)
+    if bbox:
+        clauses.append('point && ST_MakeEnvelope(%s, %s, %s, %s, 4283)')
+        params.extend(bbox)
+    fmt = request.GET.get('format', 'json')
+    if fmt not in ('json', 'columnar', 'binary'):
+        return HttpResponseBadRequest('format must be one of json, columnar or binary')
+    # The binary format only includes names.
+    fields = ['name'] if fmt == 'binary' else geojson_properties(request.GET.get('fields'))
+    where = ' AND '.join(clauses)
+
+    sql = 'SELECT id, ST_X(point), ST_Y(point), {} FROM naturemap_taxonlocation WHERE {} AND id > %s ORDER BY id LIMIT %s'.format(
+        ', '.join(fields), where)
+    cursor = connection.cursor()
+    cursor.execute(sql, params + [after_id, limit])
+    rows = cursor.fetchall()
+
+    if fmt == 'columnar':
+        resp = JsonResponse(columnar_points(rows, fields))
+    elif fmt == 'binary':
+        resp = HttpResponse(packed_points(rows), content_type='application/octet-stream')
+        resp['X-Count'] = len(rows)
+    else:
+        objs = []
+        for row in rows:
+            obj = {'id': row[0], 'lon': row[1], 'lat': row[2]}
+            obj.update(zip(fields, row[3:]))
+            objs.append(obj)
+        resp = JsonResponse(objs, safe=False)
+    resp['X-Total-Estimate'] = estimate_sql_count(
+        'SELECT id FROM naturemap_taxonlocation WHERE {}'.format(where), params)
+    if len(rows) == limit:
+        resp['X-Next-After-Id'] = rows[-1][0]
+    return resp
+
+
+def area_filter(request):
+    """Returns a tuple of (SQL WHERE clause, params) for the spatial area in the request
+    parameters (`point` & `r`, or `poly`), or None. Raises FilterError for an invalid area.
+    """
+    # Query by point and radius:
+    if 'point' in request.GET and request.GET['point']:
+        try:
+            lon, lat = [float(i) for i in request.GET['point'].split(',')]
+            if 'r' in request.GET and request.GET['r']:
+                radius = float(request.GET['r'])  # Radius in metres.
+            else:
+                radius = 100.0
+        except ValueError:
+            raise FilterError('point must be in the format lon,lat and r must be a number')
+        return RADIUS_SQL, (lon, lat, radius)
+    # Query by area:
+    elif 'poly' in request.GET and request.GET['poly']:
+        # WKT string of a polygon (GDA94/EPSG 4283 assumed).
+        return polygon_filter(request.GET['poly'])
+    return None
 
 
 class TaxonLocationNameAPI(View):
     """Lightweight API endpoint to query TaxonLocation objects based upon name.
+    Point results are paged (see page_response). Pass `aggregate=grid` (plus `zoom` and
+    optionally `bbox`) to return grid clusters of the matching objects instead.
     Reference: https://www.psycopg.org/docs/usage.html#passing-parameters-to-sql-queries
     """
     http_method_names = ['get']
 
+    @cached_response('naturemap')
     def get(self, request, *args, **kwargs):
-        # If we're downloading, make use of the Django ORM (slower) so that we can alse use the
-        # serialise function to generate GeoJSON.
+        # If we're downloading, stream the results as GeoJSON.
         if 'download' in request.GET:
-            # Queryset filter based on passed in param `name` (assumes exact, case-insenstive match):
+            # Filter based on passed in param `name` (case-insensitive match on any part of the name):
             if 'name' in request.GET and request.GET['name']:
                 name = request.GET['name']
-                objects = TaxonLocation.objects.filter(name__icontains=name)
-                data = serialize('geojson', objects, geometry_field='point', fields=('name',))
-                resp = HttpResponse(data, content_type='application/json')
-                resp['Content-Disposition'] = 'attachment; filename="{}_{}.geojson"'.format(name.replace(' ', '_').lower(), datetime.now().isoformat())
-                return resp
+                try:
+                    clauses, params = date_filters(request.GET)
+                except FilterError as e:
+                    return HttpResponseBadRequest(str(e))
+                return geojson_response(
+                    ' AND '.join(['effective_to IS NULL', 'name ILIKE %s'] + clauses), ['%{}%'.format(like_escape(name))] + params,
+                    '{}_{}.geojson'.format(name.replace(' ', '_').lower(), datetime.now().isoformat()),
+                    geojson_properties(request.GET.get('fields')),
+                    gzip=bool(request.GET.get('gzip')),
+                )
+
+        if request.GET.get('aggregate') == 'grid' and request.GET.get('name'):
+            return aggregate_response(request)
 
         # If we're not downloading, bypass the Django ORM for performance.
-        # NOTE: using ILIKE in the WHERE clause uses the Gin index on the name field (using = does not).
-        # Query unique names based on passed-in param `q`:
+        # Query unique names based on passed-in param `q`, from the materialised view of distinct
+        # names: names starting with `q` (using the prefix index) first, then names containing `q`
+        # (using the trigram index), each ranked by number of occurrences.
         if 'q' in request.GET and request.GET['q']:
+            q = like_escape(request.GET['q'].lower())
+            limit = settings.NATUREMAP_NAME_SUGGESTIONS
             cursor = connection.cursor()
-            sql = 'SELECT DISTINCT name FROM naturemap_taxonlocation WHERE name ILIKE %s'
-            params = ('%{}%'.format(request.GET['q']),)
-            cursor.execute(sql, params)
+            sql = """SELECT name FROM naturemap_taxonname WHERE lower(name) LIKE %s
+                ORDER BY occurrences DESC, name LIMIT %s"""
+            cursor.execute(sql, ('{}%'.format(q), limit))
             rows = [row[0] for row in cursor.fetchall()]
-        # Query sample points based on passed in param `name` (assumes exact, case-insenstive match):
+            if len(rows) < limit:
+                sql = """SELECT name FROM naturemap_taxonname WHERE name ILIKE %s AND lower(name) NOT LIKE %s
+                    ORDER BY occurrences DESC, name LIMIT %s"""
+                cursor.execute(sql, ('%{}%'.format(q), '{}%'.format(q), limit - len(rows)))
+                rows += [row[0] for row in cursor.fetchall()]
+        # Query a page of sample points based on passed in param `name` (case-insensitive prefix match):
         elif 'name' in request.GET and request.GET['name']:
-            cursor = connection.cursor()
-            sql = 'SELECT id, name, ST_X(point), ST_Y(point) FROM naturemap_taxonlocation WHERE name ILIKE %s'
-            params = ('{}%'.format(request.GET['name']),)
-            cursor.execute(sql, params)
-            rows = [{'id': row[0], 'name': row[1], 'lon': row[2], 'lat': row[3]} for row in cursor.fetchall()]
+            return page_response(request)
         else:
             rows = []
 
@@ -51,46 +175,123 @@ class TaxonLocationNameAPI(View):
 class TaxonLocationAreaAPI(View):
     """API endpoint to equery TaxonLocation objects based on spatial area.
     Area can be supplied as a buffered point (point, radius in metres) or as a polygon (WKT).
+    Point results are paged (see page_response). Pass `aggregate=grid` (plus `zoom` and
+    optionally `bbox`) to return grid clusters of the matching objects instead.
     Reference: https://www.psycopg.org/docs/usage.html#passing-parameters-to-sql-queries
     """
     http_method_names = ['get']
 
+    @cached_response('naturemap')
     def get(self, request, *args, **kwargs):
-        # If we're downloading, make use of the Django ORM (slower) so that we can alse use the
-        # serialise function to generate GeoJSON.
+        try:
+            area = area_filter(request)
+        except FilterError as e:
+            return HttpResponseBadRequest(str(e))
+
+        # If we're downloading, stream the results as GeoJSON.
         if 'download' in request.GET:
-            # TODO: parse spatial queries.
+            filename = 'taxon_locations_{}.geojson'.format(datetime.now().isoformat())
+            properties = geojson_properties(request.GET.get('fields'))
+            gzip = bool(request.GET.get('gzip'))
             if 'ids' in request.GET and request.GET['ids']:
-                ids = request.GET['ids'].split(',')
-                objects = TaxonLocation.objects.filter(id__in=ids)
-                data = serialize('geojson', objects, geometry_field='point', fields=('name',))
-                resp = HttpResponse(data, content_type='application/json')
-                resp['Content-Disposition'] = 'attachment; filename="taxon_locations_{}.geojson"'.format(datetime.now().isoformat())
-                return resp
-
-        # Query by point and radius:
-        if 'point' in request.GET and request.GET['point']:
-            lon, lat = [float(i) for i in request.GET['point'].split(',')]
-            if 'r' in request.GET and request.GET['r']:
-                radius = float(request.GET['r'])  # Radius in metres.
-            else:
-                radius = 100.0
-            sql = 'SELECT id, name, ST_X(point), ST_Y(point) FROM naturemap_taxonlocation WHERE ST_DWithin(geography(point), ST_SetSRID(ST_MakePoint(%s,%s), 4283), %s)'
-            params = (lon, lat, radius)
-            cursor = connection.cursor()
-            cursor.execute(sql, params)
-            rows = [{'id': row[0], 'name': row[1], 'lon': row[2], 'lat': row[3]} for row in cursor.fetchall()]
-        # Query by area:
-        elif 'poly' in request.GET and request.GET['poly']:
-            params = (request.GET['poly'],)  # WKT string of a polygon (GDA94/EPSG 4283 assumed).
-            sql = 'SELECT id, name, ST_X(point), ST_Y(point) FROM naturemap_taxonlocation WHERE ST_Within(point, ST_GeomFromText(%s, 4283))'
-            cursor = connection.cursor()
-            cursor.execute(sql, params)
-            rows = [{'id': row[0], 'name': row[1], 'lon': row[2], 'lat': row[3]} for row in cursor.fetchall()]
-        else:
-            rows = []
+                ids = [int(i) for i in request.GET['ids'].split(',') if i.strip().isdigit()]
+                return geojson_response(
+                    'effective_to IS NULL AND id = ANY(%s)', (ids,), filename, properties, gzip=gzip)
+            elif area:
+                try:
+                    clauses, params = date_filters(request.GET)
+                except FilterError as e:
+                    return HttpResponseBadRequest(str(e))
+                return geojson_response(
+                    ' AND '.join(['effective_to IS NULL', area[0]] + clauses), list(area[1]) + params, filename, properties, gzip=gzip)
 
-        return JsonResponse(rows, safe=False)
+        if area and request.GET.get('aggregate') == 'grid':
+            return aggregate_response(request, [area[0]], area[1])
+
+        if area:
+            return page_response(request, [area[0]], area[1])
+
+        return JsonResponse([], safe=False)
+
+
+def summary_filters(request):
+    """Returns a tuple of (list of SQL WHERE clauses, list of params) for the summary endpoints,
+    from the filters in the request parameters (see filters.taxon_filters), the spatial area
+    (see area_filter) and `bbox`. Raises FilterError for invalid parameters.
+    """
+    clauses, params = taxon_filters(request.GET)
+    area = area_filter(request)
+    if area:
+        clauses.append(area[0])
+        params.extend(area[1])
+    if request.GET.get('bbox'):
+        clauses.append('point && ST_MakeEnvelope(%s, %s, %s, %s, 4283)')
+        params.extend(parse_bbox(request.GET['bbox']))
+    return clauses, params
+
+
+class TaxonLocationFacetAPI(View):
+    """API endpoint to return the total count plus counts by supra, family, kingdom and
+    conservation status of TaxonLocation objects. Accepts the same filter parameters as the name
+    and area API endpoints (see filters.taxon_filters and area_filter, plus `bbox`). Unfiltered
+    (or source-only) requests are answered from the pre-aggregated rollup view.
+    """
+    http_method_names = ['get']
+
+    @cached_response('naturemap')
+    def get(self, request, *args, **kwargs):
+        try:
+            clauses, params = summary_filters(request)
+        except FilterError as e:
+            return HttpResponseBadRequest(str(e))
+
+        filters = [k for k in FILTER_PARAMS + ('point', 'poly', 'bbox') if k != 'source' and request.GET.get(k)]
+        if not filters:
+            source = int(request.GET['source']) if request.GET.get('source') else None
+            return JsonResponse(rollup_facet_counts(source))
+        return JsonResponse(facet_counts(clauses, params))
+
+
+class TaxonLocationHistogramAPI(View):
+    """API endpoint to return counts of TaxonLocation objects per `interval` (`year`, the
+    default, or `decade`) of collected date. Accepts the same filter parameters as the name and
+    area API endpoints (see summary_filters).
+    """
+    http_method_names = ['get']
+
+    @cached_response('naturemap')
+    def get(self, request, *args, **kwargs):
+        interval = request.GET.get('interval') or 'year'
+        if interval not in HISTOGRAM_INTERVALS:
+            return HttpResponseBadRequest('interval must be one of {}'.format(', '.join(HISTOGRAM_INTERVALS)))
+        try:
+            clauses, params = summary_filters(request)
+        except FilterError as e:
+            return HttpResponseBadRequest(str(e))
+        return JsonResponse(date_histogram(clauses, params, interval))
+
+
+class TaxonLocationTileAPI(View):
+    """Endpoint to return a Mapbox Vector Tile of TaxonLocation points, filtered using the
+    optional parameters `name`, `supra`, `family`, `kingdom`, `source`, `date_from` and
+    `date_to`. Tiles use the web mercator XYZ scheme, unless parameter `crs=4326` is passed
+    (the lat/lon tile grid used by Leaflet's EPSG:4326 CRS). Tiles for known names and sources
+    are cached on disk (see tiles.tile_cacheable); all tiles may be cached by HTTP clients.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        z, x, y = kwargs['z'], kwargs['x'], kwargs['y']
+        srid = 4326 if request.GET.get('crs') == '4326' else 3857
+        if tile_bounds(z, x, y, srid) is None:
+            raise Http404('Invalid tile')
+        try:
+            tile = get_tile(z, x, y, srid, request.GET)
+        except FilterError as e:
+            return HttpResponseBadRequest(str(e))
+        resp = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        resp['Cache-Control'] = 'max-age=3600'
+        return resp
 
 
 class TaxonLocationSearch(TemplateView):
@@ -99,4 +300,5 @@ class TaxonLocationSearch(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['GEOSERVER_WMTS_URL'] = settings.GEOSERVER_WMTS_URL
+        context['VECTORGRID_INTEGRITY'] = settings.NATUREMAP_VECTORGRID_INTEGRITY
         return context
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from reversion.admin import VersionAdmin
-from waherb.utils import ModelDescMixin, ActiveAdminMixin
+from waherb.utils import ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin
 from .models import Reference, Name
 
 
@@ -26,7 +26,7 @@ class NSLURLFilter(admin.SimpleListFilter):
 
 
 @admin.register(Reference)
-class ReferenceAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
+class ReferenceAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
     fields = ('title', 'nsl_url', 'metadata')
     list_display = ('title_trunc', 'nsl_url_link', 'modified', 'modifier')
     list_filter = (NSLURLFilter,)
@@ -46,7 +46,7 @@ class ReferenceAdmin(ModelDescMixin, ActiveAdminMixin, VersionAdmin):
 
 
 @admin.register(Name)
-class NameAdmin(ModelDescMixin, VersionAdmin):
+class NameAdmin(ModelDescMixin, ActiveAdminMixin, LargeTableAdminMixin, VersionAdmin):
 
     class HasParentFilter(admin.SimpleListFilter):
         """SimpleListFilter to filter on True/False if an object has a value for parent.
@@ -74,11 +74,6 @@ class NameAdmin(ModelDescMixin, VersionAdmin):
     raw_id_fields = ('references', 'parent', 'basionym')
     search_fields = ('name', 'rank', 'parent__name', 'basionym__name')
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        # Return 'current' (non-deleted) objects only.
-        return qs.filter(effective_to=None)
-
     def nsl_url_link(self, obj):
         if obj.nsl_url:
             return mark_safe('<a href="{0}" target="_blank">{0}</a>'.format(obj.nsl_url))
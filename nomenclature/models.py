@@ -1,8 +1,11 @@
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 from django.utils import timezone
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
-from waherb.utils import AuditMixin, ActiveMixin, smart_truncate
+from mptt.querysets import TreeQuerySet
+from waherb.cache import invalidate_on_change
+from waherb.utils import AuditMixin, ActiveMixin, ActiveQuerySet, smart_truncate
 
 
 class Reference(AuditMixin, ActiveMixin):
@@ -38,6 +41,17 @@ TAXONOMIC_RANK_CHOICES = (
 )
 
 
+class NameQuerySet(TreeQuerySet, ActiveQuerySet):
+    """A QuerySet class for Name, combining the MPTT TreeQuerySet with the ActiveMixin
+    methods (current, deleted, soft_delete, etc.).
+    """
+
+
+class NameManager(TreeManager.from_queryset(NameQuerySet)):
+    """A TreeManager for Name which also provides the ActiveMixin manager methods.
+    """
+
+
 class Name(MPTTModel, AuditMixin):
     """This model represents a name for a taxonomic grouping that has been published in the
     scientific literature.
@@ -45,7 +59,8 @@ class Name(MPTTModel, AuditMixin):
 
     NOTE: we can't use ActiveMixin with this model class, as the custom Manager messes with the
     TreeManager class that MPTTModel provides.
-    We just add the effective_to field on the model manually, plus any other methods needed.
+    We just add the effective_to field on the model manually, plus any other methods needed, and
+    use NameManager to provide the ActiveMixin manager methods.
     """
     name = models.CharField(
         max_length=512, unique=True, help_text='A name that has been validly published in a reference.')
@@ -59,6 +74,7 @@ class Name(MPTTModel, AuditMixin):
     nsl_url = models.URLField(max_length=256, blank=True, null=True)
     metadata = JSONField(default=dict, blank=True)
     effective_to = models.DateTimeField(null=True, blank=True)
+    objects = NameManager()
 
     def __str__(self):
         return self.name
@@ -69,4 +85,8 @@ class Name(MPTTModel, AuditMixin):
             super().delete(*args, **kwargs)
         else:
             self.effective_to = timezone.now()
-            super().save(*args, **kwargs)
+            Name.objects.filter(pk=self.pk).soft_delete(effective_to=self.effective_to)
+
+
+# Invalidate cached taxon trees whenever Name data changes.
+invalidate_on_change(Name, 'nomenclature')
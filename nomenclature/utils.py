@@ -1,5 +1,6 @@
 import csv
 from datetime import datetime
+from waherb.cache import bump_version
 from .models import Name, Reference
 
 
@@ -59,6 +60,7 @@ def import_wacensus():
 
     print('Rebuilding MPTT tree')
     Name.objects.rebuild()  # Rebuild the MPTT tree.
+    bump_version('nomenclature')  # Invalidate cached taxon trees.
 
     """
     f = open('apni_names.csv', 'r')
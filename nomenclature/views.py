@@ -1,6 +1,7 @@
 from django.http import JsonResponse
 from django.views.generic import View
 from mptt.utils import get_cached_trees
+from waherb.cache import cached_response
 from .models import Name
 
 
@@ -21,6 +22,7 @@ class TaxonTreeView(View):
     """
     http_method_names = ['get']
 
+    @cached_response('nomenclature')
     def get(self, request, *args, **kwargs):
         name = Name.objects.get(pk=kwargs['pk'])
         root = get_cached_trees(name.get_family())[0]
@@ -0,0 +1,13 @@
+from django.core.asgi import get_asgi_application
+import dotenv
+import os
+from pathlib import Path
+
+d = Path(__file__).resolve().parents[1]
+dot_env = os.path.join(str(d), '.env')
+if os.path.exists(dot_env):
+    dotenv.read_dotenv(dot_env)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "waherb.settings")
+from waherb.lanes import DownloadMiddleware, LaneMiddleware  # noqa: E402
+application = DownloadMiddleware(LaneMiddleware(get_asgi_application()))
@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from functools import wraps
+import hashlib
+import time
+
+
+VERSION_KEY = 'dataset_version:{}'
+STATS_KEY = 'cache_stats:{}:{}'
+STATS_INDEX_KEY = 'cache_stats'
+# Datasets depending upon each model (by label), registered by invalidate_on_change.
+MODEL_DATASETS = {}
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def get_version(dataset):
+    """Returns the current version of a dataset. Cached responses are keyed on the versions of
+    the datasets they depend upon, so bumping a version invalidates all of them.
+    """
+    cache = get_cache()
+    key = VERSION_KEY.format(dataset)
+    version = cache.get(key)
+    if version is None:
+        # Start from a timestamp, so that a version lost from the cache (e.g. by eviction or a
+        # restart) is never reused.
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(dataset):
+    """Increment the version of a dataset, invalidating cached responses which depend on it.
+    """
+    cache = get_cache()
+    key = VERSION_KEY.format(dataset)
+    try:
+        return cache.incr(key)
+    except ValueError:  # The key doesn't exist.
+        version = int(time.time() * 1000)
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def invalidate_on_change(model, dataset):
+    """Connect signal receivers which bump the version of a dataset whenever an object of the
+    passed-in model is saved or deleted, and register the dataset against the model (see
+    bump_model_versions). Note that bulk and queryset update operations don't send signals, so
+    code using them must call bump_model_versions or bump_version itself.
+    """
+    def receiver(sender, **kwargs):
+        bump_version(dataset)
+
+    MODEL_DATASETS.setdefault(model._meta.label_lower, set()).add(dataset)
+    uid = 'invalidate_{}_{}'.format(model._meta.label_lower, dataset)
+    post_save.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+
+
+def bump_model_versions(model):
+    """Bump the versions of all datasets registered against the passed-in model by
+    invalidate_on_change.
+    """
+    for dataset in sorted(MODEL_DATASETS.get(model._meta.label_lower, ())):
+        bump_version(dataset)
+
+
+def _count(name, outcome):
+    cache = get_cache()
+    key = STATS_KEY.format(name, outcome)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+    names = cache.get(STATS_INDEX_KEY) or []
+    if name not in names:
+        cache.set(STATS_INDEX_KEY, names + [name], timeout=None)
+
+
+def cache_stats():
+    """Returns a dict of cache statistics (hits, misses and hit rate) for each cached view.
+    """
+    cache = get_cache()
+    stats = {}
+    for name in cache.get(STATS_INDEX_KEY) or []:
+        hits = cache.get(STATS_KEY.format(name, 'hits'), 0)
+        misses = cache.get(STATS_KEY.format(name, 'misses'), 0)
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return stats
+
+
+def response_cache_key(request, datasets, kwargs):
+    """Returns a cache key for a GET request, from the path, the URL keyword arguments, the
+    normalised (sorted, non-empty) query parameters and the current dataset versions.
+    """
+    params = sorted((k, v) for k, values in request.GET.lists() for v in values if v != '')
+    versions = [(d, get_version(d)) for d in datasets]
+    digest = hashlib.md5(repr((request.path, sorted(kwargs.items()), params, versions)).encode('utf-8')).hexdigest()
+    return 'response:{}'.format(digest)
+
+
+def cached_response(*datasets, timeout=None):
+    """Decorator for the get() method of a class-based view, to cache successful responses in
+    the API cache. The cache key depends upon the request parameters and the versions of the
+    passed-in datasets (see bump_version). Streaming responses and downloads are never cached.
+    """
+    def decorator(method):
+        name = method.__qualname__
+
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if 'download' in request.GET:
+                return method(self, request, *args, **kwargs)
+            cache = get_cache()
+            key = response_cache_key(request, datasets, kwargs)
+            response = cache.get(key)
+            if response is not None:
+                _count(name, 'hits')
+                return response
+            _count(name, 'misses')
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, response, settings.API_CACHE_TIMEOUT if timeout is None else timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,85 @@
+import asyncio
+from django.conf import settings
+from urllib.parse import parse_qs
+
+
+class LaneMiddleware:
+    """ASGI middleware which divides HTTP requests into "lanes" by path prefix, and limits the
+    number of requests in flight in each lane (a bulkhead). Under ASGI, Django runs each request
+    in a shared thread pool (sized by the ASGI_THREADS environment variable), so a burst of slow
+    requests (e.g. large polygon area queries) could otherwise occupy every thread and block
+    cheap requests such as name autocomplete.
+
+    Lanes are defined by settings.ASGI_LANES, a list of (path prefix, concurrency limit); the
+    first matching prefix is used and unmatched requests are not limited. A request which
+    waits longer than settings.ASGI_LANE_TIMEOUT seconds for a place in its lane receives a
+    503 response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lanes = None
+
+    def get_lane(self, path):
+        if self.lanes is None:
+            # Semaphores must be created inside the server's event loop.
+            self.lanes = [(prefix, asyncio.Semaphore(limit)) for prefix, limit in settings.ASGI_LANES]
+        for prefix, semaphore in self.lanes:
+            if path.startswith(prefix):
+                return semaphore
+        return None
+
+    async def __call__(self, scope, receive, send):
+        lane = self.get_lane(scope['path']) if scope['type'] == 'http' else None
+        if lane is None:
+            return await self.app(scope, receive, send)
+        try:
+            await asyncio.wait_for(lane.acquire(), settings.ASGI_LANE_TIMEOUT)
+        except asyncio.TimeoutError:
+            await send({
+                'type': 'http.response.start',
+                'status': 503,
+                'headers': [(b'content-type', b'text/plain'), (b'retry-after', b'5')],
+            })
+            await send({'type': 'http.response.body', 'body': b'Server busy, please try again shortly.'})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
+
+
+class DownloadMiddleware:
+    """ASGI middleware which keeps file downloads (requests with a `download` query parameter)
+    off the ASGI application. Django 3.0 iterates a StreamingHttpResponse on the event loop,
+    where the database queries of a streamed download raise SynchronousOnlyOperation after the
+    response has started, truncating the file.
+
+    If settings.ASGI_DOWNLOAD_URL (the base URL of the WSGI deployment) is set, download
+    requests are redirected there; otherwise they receive a 501 response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or 'download' not in parse_qs(
+                scope['query_string'].decode('latin-1'), keep_blank_values=True):
+            return await self.app(scope, receive, send)
+        if settings.ASGI_DOWNLOAD_URL:
+            location = '{}{}?{}'.format(
+                settings.ASGI_DOWNLOAD_URL.rstrip('/'), scope.get('root_path', '') + scope['path'],
+                scope['query_string'].decode('latin-1'))
+            await send({
+                'type': 'http.response.start',
+                'status': 307,
+                'headers': [(b'location', location.encode('latin-1')), (b'content-type', b'text/plain')],
+            })
+            await send({'type': 'http.response.body', 'body': b'Downloads are served by the WSGI deployment.'})
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 501,
+            'headers': [(b'content-type', b'text/plain')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Downloads are not available from this server.'})
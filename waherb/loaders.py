@@ -0,0 +1,68 @@
+from collections import deque
+from multiprocessing import Pool
+from time import perf_counter
+import os
+
+
+def copy_value(value):
+    """Format a value for use as a column in PostgreSQL COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def read_batches(items, batch_size):
+    """Generator to read an iterable (e.g. the lines of a file, or the records of a csv.reader)
+    in lists of up to `batch_size` items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parallel_copy(batches, parse, copy, processes=None):
+    """Parse batches of input in a process pool, and write each parsed batch to the database in
+    this process, in input order. Returns a tuple of (rows copied, rows rejected).
+
+    `batches` yields tuples of (batch, context). `parse` is called with each batch in a worker
+    process (so it must be a module-level function that doesn't touch the database), and must
+    return a tuple of (COPY text buffer, row count, list of rejected rows as strings). `copy` is
+    then called with the buffer and the batch context, and should write the buffer using COPY.
+
+    The caller must close the database connection before calling this, so that an open
+    connection isn't carried into the forked worker processes.
+    """
+    processes = processes or os.cpu_count()
+    count = 0
+    rejected = 0
+    then = perf_counter()
+
+    def write(result, context):
+        nonlocal count, rejected, then
+        buf, n, bad = result.get()
+        copy(buf, context)
+        count += n
+        rejected += len(bad)
+        for text in bad:
+            print('Rejected invalid row: {}'.format(text[:200]))
+        now = perf_counter()
+        print('Processed {} records, {:.0f} records/sec'.format(count, n / max(now - then, 1e-6)))
+        then = now
+
+    with Pool(processes) as pool:
+        # Bound the number of batches in flight so that memory use stays flat, and write them in
+        # input order so that any progress recorded by `copy` stays sequential.
+        pending = deque()
+        for batch, context in batches:
+            pending.append((pool.apply_async(parse, (batch,)), context))
+            if len(pending) > processes * 2:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+    return count, rejected
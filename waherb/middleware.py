@@ -0,0 +1,18 @@
+from .utils import set_current_user, reset_current_user
+
+
+class CurrentUserMiddleware:
+    """Middleware to record the authenticated user making each request as the current user,
+    so that AuditMixin.save() doesn't need to look it up. Must be placed after any middleware
+    which authenticates the user.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        token = set_current_user(user if user is not None and user.is_authenticated else None)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_user(token)
@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'dbca_utils.middleware.SSOLoginMiddleware',
+    'waherb.middleware.CurrentUserMiddleware',
 ]
 
 ROOT_URLCONF = 'waherb.urls'
@@ -69,6 +70,21 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'waherb.wsgi.application'
+ASGI_APPLICATION = 'waherb.asgi.application'
+
+# ASGI request lanes: (path prefix, maximum concurrent requests). See waherb.lanes.
+# Slow spatial queries get a small lane, so that they can't occupy every thread.
+ASGI_LANES = [
+    ('/naturemap/api/area/', int(os.getenv('ASGI_AREA_LANE', 4))),
+    ('/naturemap/api/facets/', int(os.getenv('ASGI_AREA_LANE', 4))),
+    ('/naturemap/tiles/', int(os.getenv('ASGI_TILE_LANE', 8))),
+    ('/naturemap/api/', int(os.getenv('ASGI_API_LANE', 16))),
+    ('/graph/', int(os.getenv('ASGI_API_LANE', 16))),
+]
+ASGI_LANE_TIMEOUT = float(os.getenv('ASGI_LANE_TIMEOUT', 30))
+# Base URL of the WSGI deployment, to which the ASGI application redirects download requests
+# (see waherb.lanes.DownloadMiddleware). If unset, downloads are refused under ASGI.
+ASGI_DOWNLOAD_URL = os.getenv('ASGI_DOWNLOAD_URL', '')
 
 
 DATABASES = {
@@ -76,6 +92,35 @@ DATABASES = {
 }
 
 
+# Caching
+# CACHE_BACKEND may be `file` (default), `db` (run `createcachetable` first) or `locmem`.
+# Cached API responses are invalidated by bumping dataset versions held in the cache, so the
+# backend must be shared between the web server processes and any import processes; `locmem`
+# is per-process, so it is only suitable for development (and uses a short timeout).
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'file')
+CACHE_OPTIONS = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000))}
+if CACHE_BACKEND == 'file':
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': CACHE_OPTIONS,
+    }}
+elif CACHE_BACKEND == 'db':
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', 'waherb_cache'),
+        'OPTIONS': CACHE_OPTIONS,
+    }}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': CACHE_OPTIONS,
+    }}
+# Cache alias and timeout (seconds) for cached API responses.
+API_CACHE_ALIAS = 'default'
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', 60 if CACHE_BACKEND == 'locmem' else 86400))
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -116,6 +161,22 @@ GEOSERVER_WMS_URL = os.getenv('GEOSERVER_WMS_URL', '')
 GEOSERVER_WMTS_URL = os.getenv('GEOSERVER_WMTS_URL', '')
 
 
+# Naturemap vector tile disk cache
+NATUREMAP_TILE_CACHE = os.getenv('NATUREMAP_TILE_CACHE', os.path.join(BASE_DIR, 'tile_cache'))
+# Tiles above this zoom level are not cached on disk, and the cache stops growing at this many tiles.
+NATUREMAP_TILE_CACHE_MAX_ZOOM = int(os.getenv('NATUREMAP_TILE_CACHE_MAX_ZOOM', 14))
+NATUREMAP_TILE_CACHE_MAX_FILES = int(os.getenv('NATUREMAP_TILE_CACHE_MAX_FILES', 200000))
+# Subresource Integrity hash of the Leaflet.VectorGrid script loaded by the Naturemap page
+# (e.g. sha384-...; see README).
+NATUREMAP_VECTORGRID_INTEGRITY = os.getenv('NATUREMAP_VECTORGRID_INTEGRITY', '')
+
+# Naturemap API page size (number of objects returned per request)
+NATUREMAP_API_PAGE_SIZE = int(os.getenv('NATUREMAP_API_PAGE_SIZE', 1000))
+NATUREMAP_API_MAX_PAGE_SIZE = int(os.getenv('NATUREMAP_API_MAX_PAGE_SIZE', 10000))
+# Maximum number of name autocomplete suggestions
+NATUREMAP_NAME_SUGGESTIONS = int(os.getenv('NATUREMAP_NAME_SUGGESTIONS', 20))
+
+
 # Site settings
 ENVIRONMENT_NAME = os.getenv('ENVIRONMENT_NAME', '')
 ENVIRONMENT_COLOUR = os.getenv('ENVIRONMENT_COLOUR', '')
@@ -2,9 +2,11 @@ from django.urls import include, path
 from django.views.generic import RedirectView
 from django.contrib import admin
 from nomenclature import urls as nomenclature_urls
+from herbarium import urls as herbarium_urls
 from crossreference import urls as crossreference_urls
 from naturemap import urls as naturemap_urls
 from graphic import urls as graphic_urls
+from .views import CacheStatsView
 
 admin.site.site_header = 'WAHerb database administration'
 admin.site.index_title = 'WAHerb database'
@@ -12,7 +14,9 @@ admin.site.site_title = 'WAHerb'
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/cache-stats/', CacheStatsView.as_view(), name='cache_stats'),
     path('', include(nomenclature_urls, namespace='nomenclature')),
+    path('', include(herbarium_urls, namespace='herbarium')),
     path('', include(crossreference_urls, namespace='crossreference')),
     path('', include(naturemap_urls, namespace='naturemap')),
     path('', include(graphic_urls, namespace='graphic')),
@@ -1,18 +1,73 @@
 from django.conf import settings
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
 from django.contrib.admin import ModelAdmin
+from django.contrib.admin.views.main import ChangeList, ERROR_FLAG, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models
+from django.core import serializers
+from django.db import connections, router, transaction
+from django.db.models.query import ModelIterable
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils import timezone
-from django.utils.encoding import smart_text
+from django.utils.encoding import force_str, smart_text
 from leaflet.admin import LeafletGeoAdmin
-from reversion.revisions import create_revision, set_comment
-import threading
+from reversion.revisions import create_revision, is_registered, set_comment, _get_options
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+from waherb.cache import bump_model_versions
 
 
 INITIAL_COMMENT = 'Initial version.'
 
+# The user performing the current request or job, used to record auditing information.
+_current_user = ContextVar('current_user', default=None)
+_default_user = None
+# Set while an untracked queryset is loading instances (see AuditQuerySet.untracked).
+_untracked = ContextVar('untracked', default=False)
+
+
+def get_current_user():
+    """Returns the user performing the current request (set by CurrentUserMiddleware) or job
+    (set using acting_as). Falls back on using the admin user with ID 1, which is queried once
+    per process.
+    """
+    global _default_user
+    user = _current_user.get()
+    if user is None:
+        if _default_user is None:
+            _default_user = get_user_model().objects.get(pk=1)
+        user = _default_user
+    return user
+
+
+def set_current_user(user):
+    """Set the current user for this context, returning a token which can be passed to
+    reset_current_user to restore the previous value. Pass None to use the default user.
+    """
+    return _current_user.set(user)
+
+
+def reset_current_user(token):
+    _current_user.reset(token)
+
+
+@contextmanager
+def acting_as(user):
+    """Context manager to set the current user for a management command or job, e.g.:
+
+        with acting_as(User.objects.get(username='admin')):
+            obj.save()
+    """
+    token = set_current_user(user)
+    try:
+        yield user
+    finally:
+        reset_current_user(token)
+
 
 class AuditMixin(models.Model):
     """A model mixin that provides fields related to auditing: created/modified timestamps,
@@ -30,13 +85,44 @@ class AuditMixin(models.Model):
     created = models.DateTimeField(default=timezone.now, editable=False)
     modified = models.DateTimeField(auto_now=True, editable=False)
 
-    def __init__(self, *args, **kwargs):
-        super(AuditMixin, self).__init__(*args, **kwargs)
-        self._changed_data = None
-        self._initial = {}
-        if self.pk:
-            for field in self._meta.fields:
-                self._initial[field.attname] = getattr(self, field.attname)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(AuditMixin, cls).from_db(db, field_names, values)
+        # Keep a reference to the loaded field names & values for change tracking, instead of
+        # copying them into a dict. The field_names list is shared by every instance loaded by
+        # a queryset and the values tuple already exists, so no per-instance data is allocated.
+        # Deferred fields aren't in field_names, so they're never compared.
+        if not _untracked.get():
+            instance._loaded_values = (field_names, values)
+        return instance
+
+    def _track(self, attnames=None):
+        """Record the current values of the passed-in loaded fields (default: all loaded
+        fields) as the initial values for change tracking.
+        """
+        if attnames is None:
+            attnames = [f.attname for f in self._meta.concrete_fields if f.attname in self.__dict__]
+        self._loaded_values = (attnames, tuple(self.__dict__[f] for f in attnames))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        if fields is None:
+            self._track()
+        elif self.is_tracked:
+            # Only the refreshed fields' initial values change.
+            initial = dict(zip(*self._loaded_values))
+            initial.update(
+                (f.attname, self.__dict__[f.attname]) for f in self._meta.concrete_fields
+                if f.attname in self.__dict__ and (f.name in fields or f.attname in fields))
+            self._loaded_values = (list(initial), tuple(initial.values()))
+
+    @property
+    def is_tracked(self):
+        """
+        Returns true if the initial field values of this object are known (i.e. it was loaded
+        from the database using a tracked queryset, or has been saved).
+        """
+        return getattr(self, '_loaded_values', None) is not None
 
     def has_changed(self):
         """
@@ -45,63 +131,47 @@ class AuditMixin(models.Model):
         return bool(self.changed_data)
 
     def _get_changed_data(self):
-        if self._changed_data is None:
-            self._changed_data = []
-            for field, value in self._initial.items():
-                if field in ["modified", "modifier_id"]:
-                    continue
-                if getattr(self, field) != value:
-                    self._changed_data.append(field)
-        return self._changed_data
+        if not self.is_tracked:
+            return []
+        return [
+            field for field, value in zip(*self._loaded_values)
+            if field not in ('modified', 'modifier_id') and getattr(self, field) != value
+        ]
     changed_data = property(_get_changed_data)
 
     def save(self, *args, **kwargs):
         """
-        This falls back on using an admin user if a thread request object wasn't found
+        The creator/modifier is set to the current user (see get_current_user), which falls
+        back on using an admin user if no user has been set for the request or job.
         """
-        User = get_user_model()
-        _locals = threading.local()
-
-        if ((not hasattr(_locals, "request") or _locals.request.user.is_anonymous())):
-            if hasattr(_locals, "user"):
-                user = _locals.user
-            else:
-                try:
-                    user = User.objects.get(pk=_locals.request.user.pk)
-                except Exception:
-                    user = User.objects.get(id=1)
-                _locals.user = user
-        else:
-            try:
-                user = User.objects.get(pk=_locals.request.user.pk)
-            except Exception:
-                user = User.objects.get(id=1)
+        user = get_current_user()
 
         # If saving a new model, set the creator.
         if not self.pk:
-            try:
-                self.creator
-            except ObjectDoesNotExist:
+            if self.creator_id is None:
                 self.creator = user
-
-            try:
-                self.modifier
-            except ObjectDoesNotExist:
+            if self.modifier_id is None:
                 self.modifier = user
-
             created = True
         else:
             created = False
             self.modifier = user
 
+        # Compare against the initial values before saving, then track the saved values.
+        tracked = self.is_tracked
+        changed_data = self.changed_data
         super(AuditMixin, self).save(*args, **kwargs)
+        self._track()
 
         if created:
             with create_revision():
                 set_comment('Initial version.')
         else:
-            if self.has_changed():
-                comment = 'Changed ' + ', '.join(self.changed_data) + '.'
+            if not tracked:
+                with create_revision():
+                    set_comment('Changed.')
+            elif changed_data:
+                comment = 'Changed ' + ', '.join(changed_data) + '.'
                 with create_revision():
                     set_comment(comment)
             else:
@@ -142,8 +212,125 @@ class AuditMixin(models.Model):
             raise ValidationError(errors)
 
 
-class ActiveModelManager(models.Manager):
-    """A customised Manager class to be used for with ActiveMixin.
+def create_bulk_revision(model, objs, comment, user=None, using=None, batch_size=1000):
+    """Save a single django-reversion Revision containing a Version of each of the passed-in
+    objects (an iterable of instances of `model`), writing the Version rows with bulk_create
+    in batches. Objects without a pk, or models not registered with reversion, are skipped.
+    Returns the Revision, or None.
+    """
+    from reversion.models import Revision, Version
+
+    if not is_registered(model):
+        return None
+    using = using or router.db_for_write(model)
+    options = _get_options(model)
+    content_type = ContentType.objects.db_manager(using).get_for_model(
+        model, for_concrete_model=options.for_concrete_model)
+    revision = None
+    versions = []
+
+    for obj in objs:
+        if obj.pk is None:
+            continue
+        if revision is None:
+            revision = Revision.objects.using(using).create(date_created=timezone.now(), user=user, comment=comment)
+        versions.append(Version(
+            revision=revision,
+            content_type=content_type,
+            object_id=force_str(obj.pk),
+            db=using,
+            format=options.format,
+            serialized_data=serializers.serialize(
+                options.format, (obj,), fields=options.fields,
+                use_natural_foreign_keys=options.use_natural_foreign_keys),
+            object_repr=force_str(obj),
+        ))
+        if len(versions) == batch_size:
+            Version.objects.using(using).bulk_create(versions)
+            versions = []
+
+    if versions:
+        Version.objects.using(using).bulk_create(versions)
+    return revision
+
+
+class UntrackedModelIterable(ModelIterable):
+    """Iterable which yields model instances without change tracking (see AuditMixin). Tracking
+    is switched off only while each instance is loaded, as the iteration may be interleaved with
+    other queries.
+    """
+    def __iter__(self):
+        objs = super().__iter__()
+        while True:
+            token = _untracked.set(True)
+            try:
+                obj = next(objs)
+            except StopIteration:
+                return
+            finally:
+                _untracked.reset(token)
+            yield obj
+
+
+class AuditQuerySet(models.QuerySet):
+    """A QuerySet class for models using AuditMixin, providing bulk write methods that still
+    record auditing information. The creator/modifier user and modified timestamp are set
+    once for the whole batch, and a single reversion Revision is saved for the batch.
+    """
+    def _audit_user(self, user):
+        return user or get_current_user()
+
+    def untracked(self):
+        """Returns model instances without change tracking, e.g. for large read-only loops.
+        Saving an untracked instance records a generic 'Changed.' revision comment.
+        """
+        clone = self._chain()
+        clone._iterable_class = UntrackedModelIterable
+        return clone
+
+    def audited_bulk_create(self, objs, user=None, comment=INITIAL_COMMENT, **kwargs):
+        """bulk_create the passed-in objects, setting the creator and modifier of each.
+        Any additional keyword arguments are passed to bulk_create().
+        """
+        user = self._audit_user(user)
+        now = timezone.now()
+        objs = list(objs)
+        for obj in objs:
+            if obj.creator_id is None:
+                obj.creator = user
+            if obj.modifier_id is None:
+                obj.modifier = user
+            obj.modified = now
+        with transaction.atomic(using=self.db):
+            objs = self.bulk_create(objs, **kwargs)
+            create_bulk_revision(self.model, objs, comment, user, self.db)
+        if objs:
+            # bulk_create sends no signals, so invalidate the cached datasets here.
+            bump_model_versions(self.model)
+        return objs
+
+    def audited_bulk_update(self, objs, fields, user=None, comment=None, **kwargs):
+        """bulk_update the passed-in fields of the passed-in objects, setting the modifier and
+        modified timestamp of each. Any additional keyword arguments are passed to bulk_update().
+        """
+        user = self._audit_user(user)
+        now = timezone.now()
+        objs = list(objs)
+        for obj in objs:
+            obj.modifier = user
+            obj.modified = now
+        fields = list(fields) + [f for f in ('modifier', 'modified') if f not in fields]
+        comment = comment or 'Changed ' + ', '.join(f for f in fields if f not in ('modifier', 'modified')) + '.'
+        with transaction.atomic(using=self.db):
+            self.bulk_update(objs, fields, **kwargs)
+            create_bulk_revision(self.model, objs, comment, user, self.db)
+        if objs:
+            bump_model_versions(self.model)
+
+
+class ActiveQuerySet(AuditQuerySet):
+    """A QuerySet class to be used with ActiveMixin (all of the ActiveMixin models in this
+    project also use AuditMixin).
     """
     def current(self):
         return self.filter(effective_to=None)
@@ -151,6 +338,46 @@ class ActiveModelManager(models.Manager):
     def deleted(self):
         return self.filter(effective_to__isnull=False)
 
+    def _set_effective_to(self, effective_to, user, comment):
+        """Set effective_to on the objects in this queryset using a single UPDATE (also setting
+        the modifier and modified timestamp), and record a single revision of the changed
+        objects. As an UPDATE sends no signals, the cached datasets registered against the model
+        are invalidated here. Returns the number of objects updated.
+        """
+        user = self._audit_user(user)
+        updates = {'effective_to': effective_to}
+        if issubclass(self.model, AuditMixin):
+            updates.update(modifier=user, modified=timezone.now())
+        # Only update objects whose state actually changes.
+        qs = self.filter(effective_to__isnull=effective_to is not None)
+
+        with transaction.atomic(using=self.db):
+            if not is_registered(self.model):
+                count = qs.order_by().update(**updates)
+            else:
+                pks = list(qs.order_by().values_list('pk', flat=True))
+                base_qs = self.model._base_manager.using(self.db).filter(pk__in=pks)
+                count = base_qs.update(**updates)
+                create_bulk_revision(self.model, base_qs.iterator(chunk_size=1000), comment, user, self.db)
+        if count:
+            bump_model_versions(self.model)
+        return count
+
+    def soft_delete(self, user=None, effective_to=None):
+        """'Delete' the current objects in this queryset by setting effective_to (default: now).
+        """
+        return self._set_effective_to(effective_to or timezone.now(), user, 'Deleted.')
+
+    def restore(self, user=None):
+        """Restore the deleted objects in this queryset, by clearing effective_to.
+        """
+        return self._set_effective_to(None, user, 'Restored.')
+
+
+class ActiveModelManager(models.Manager.from_queryset(ActiveQuerySet)):
+    """A customised Manager class to be used for with ActiveMixin.
+    """
+
 
 class ActiveMixin(models.Model):
     """Model mixin to allow objects to be saved as 'non-current' or 'inactive',
@@ -181,7 +408,7 @@ class ActiveMixin(models.Model):
             super().delete(*args, **kwargs)
         else:
             self.effective_to = timezone.now()
-            super().save(*args, **kwargs)
+            self.__class__._default_manager.filter(pk=self.pk).soft_delete(effective_to=self.effective_to)
 
 
 class ModelDescMixin(ModelAdmin):
@@ -207,9 +434,239 @@ class ActiveAdminMixin(ModelAdmin):
         return self.model._default_manager.current()
 
     def delete_queryset(self, request, queryset):
-        # Override delete_queryset() otherwise the model's delete() method will not be called.
-        for obj in queryset:
-            obj.delete()
+        # Override delete_queryset() to soft-delete the objects, instead of deleting them.
+        queryset.soft_delete(user=request.user)
+
+    def get_deleted_objects(self, objs, request):
+        # Soft-deleting objects doesn't cascade to related objects, so don't collect them (which
+        # is very slow for a large selection). Just list (up to 100 of) the objects themselves.
+        opts = self.model._meta
+        count = len(objs) if isinstance(objs, list) else objs.count()
+        deleted_objects = [str(obj) for obj in objs[:100]]
+        if count > 100:
+            deleted_objects.append('...and {} more'.format(count - 100))
+        return deleted_objects, {opts.verbose_name_plural: count}, set(), []
+
+
+def estimate_count(queryset):
+    """Returns the query planner's estimate of the number of rows returned by a queryset,
+    instead of running a COUNT(*) query. For an unfiltered queryset this is the table row
+    estimate from pg_class (maintained by VACUUM/ANALYZE); otherwise it is the row estimate
+    from EXPLAIN.
+    """
+    with connections[queryset.db].cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', (queryset.model._meta.db_table,))
+            row = cursor.fetchone()
+            return max(row[0], 0) if row else 0
+    sql, params = queryset.order_by().query.sql_with_params()
+    return estimate_sql_count(sql, params, using=queryset.db)
+
+
+def estimate_sql_count(sql, params=None, using='default'):
+    """Returns the query planner's estimate of the number of rows returned by a raw SQL query
+    (the row estimate from EXPLAIN).
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+# Changelist query parameters holding the ordering key of the last (or first) row of the
+# current page, used to seek to the next (or previous) page (see LargeTableChangeList).
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+class LargeTablePaginator(Paginator):
+    """A Paginator for querysets over large tables, which avoids the two slow parts of the
+    standard Paginator:
+
+    - `count`: if `estimate` is True the planner's row estimate is used (see estimate_count);
+      otherwise the exact count is capped at `count_cap` rows, so that counting a broad filter
+      stops early. Estimates smaller than `count_cap` are replaced with an exact count. The
+      `estimated` and `capped` attributes record which of these applies.
+    - `seek`: returns the page of rows after (or before) an ordering key, using a WHERE clause
+      on the ordering columns instead of an OFFSET, so that every page costs the same to read.
+    """
+    count_cap = 10000
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, estimate=False, count_cap=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.estimate = estimate
+        self.estimated = False
+        self.capped = False
+        if count_cap is not None:
+            self.count_cap = count_cap
+
+    @cached_property
+    def count(self):
+        if self.estimate:
+            estimate = estimate_count(self.object_list)
+            if estimate > self.count_cap:
+                self.estimated = True
+                return estimate
+        count = self.object_list[:self.count_cap + 1].count()
+        self.capped = count > self.count_cap
+        return min(count, self.count_cap)
+
+    @cached_property
+    def seek_fields(self):
+        """Returns a list of (field, descending) for the ordering of the queryset, up to and
+        including the pk, or None if the queryset can't be paged by seeking: every ordering term
+        must be a non-null, non-relation field of the model, and the pk must be included so that
+        the ordering key is unique.
+        """
+        opts = self.object_list.model._meta
+        fields = []
+        for term in self.object_list.query.order_by:
+            if not isinstance(term, str):
+                return None
+            name = term.lstrip('-')
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.is_relation or field.null or not field.concrete:
+                return None
+            fields.append((field, term.startswith('-')))
+            if field.primary_key:
+                return fields
+        return None
+
+    def seek_key(self, obj):
+        """Returns the ordering key of an object, serialised as a string for a query parameter.
+        """
+        return json.dumps([field.value_to_string(obj) for field, _ in self.seek_fields])
+
+    def parse_seek_key(self, key):
+        """Returns the list of ordering values in a serialised key, or None if it is invalid.
+        """
+        try:
+            values = json.loads(key)
+            if not isinstance(values, list) or len(values) != len(self.seek_fields):
+                return None
+            return [field.to_python(value) for (field, _), value in zip(self.seek_fields, values)]
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def seek(self, key=None, forward=True):
+        """Returns a tuple of (list of objects, more) for the page of rows after the passed-in
+        serialised ordering key (or before it, if `forward` is False), or the first page if there
+        is no key. `more` is True if there are further rows in the same direction.
+        Requires seek_fields.
+        """
+        values = self.parse_seek_key(key) if key else None
+        object_list = self.object_list
+        if values is not None:
+            condition = models.Q()
+            for i, (field, descending) in enumerate(self.seek_fields):
+                # Rows after the key sort higher on an ascending field, lower on a descending one.
+                lookup = 'gt' if descending != forward else 'lt'
+                term = models.Q(**{'{}__{}'.format(field.attname, lookup): values[i]})
+                for (prior, _), value in zip(self.seek_fields[:i], values):
+                    term &= models.Q(**{prior.attname: value})
+                condition |= term
+            object_list = object_list.filter(condition)
+        if not forward:
+            object_list = object_list.reverse()
+        objects = list(object_list[:self.per_page + 1])
+        more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if not forward:
+            objects.reverse()
+        return objects, more
+
+
+class LargeTableChangeList(ChangeList):
+    """A ChangeList for LargeTableAdminMixin. Where the list ordering allows it (see
+    LargeTablePaginator.seek_fields), pages are linked by the ordering key of the last row on the
+    page (`after`) or the first row (`before`), rather than by page number; otherwise pages are
+    numbered, but can continue past an estimated or capped count. Either way, Previous and Next
+    links are shown instead of page numbers (see the admin/pagination.html template).
+    """
+    large_table = True
+
+    def get_queryset(self, request):
+        # The seek parameters aren't filters.
+        self.after = self.params.pop(AFTER_VAR, None)
+        self.before = self.params.pop(BEFORE_VAR, None)
+        return super().get_queryset(request)
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        result_count = paginator.count
+        can_show_all = result_count <= self.list_max_show_all and not (paginator.estimated or paginator.capped)
+        multi_page = result_count > self.list_per_page or paginator.capped
+        self.previous_url = self.next_url = None
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.queryset._clone()
+        elif paginator.seek_fields:
+            if self.before:
+                result_list, more = paginator.seek(self.before, forward=False)
+                has_previous, has_next = more, True
+            else:
+                result_list, more = paginator.seek(self.after)
+                has_previous, has_next = bool(self.after), more
+            if result_list and has_previous:
+                self.previous_url = self.get_query_string({BEFORE_VAR: paginator.seek_key(result_list[0])})
+            if result_list and has_next:
+                self.next_url = self.get_query_string({AFTER_VAR: paginator.seek_key(result_list[-1])})
+        else:
+            bottom = self.page_num * self.list_per_page
+            result_list = list(self.queryset[bottom:bottom + self.list_per_page + 1])
+            if len(result_list) > self.list_per_page:
+                result_list = result_list[:self.list_per_page]
+                self.next_url = self.get_query_string({PAGE_VAR: self.page_num + 1})
+            if self.page_num > 0:
+                self.previous_url = self.get_query_string({PAGE_VAR: self.page_num - 1})
+        self.first_url = self.get_query_string() if self.previous_url else None
+        if self.list_editable and isinstance(result_list, list):
+            # The list_editable formset requires a queryset.
+            result_list = self.queryset.filter(pk__in=[obj.pk for obj in result_list])
+
+        self.result_count = result_count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.full_result_count = self.root_queryset.count() if self.show_full_result_count else None
+        self.show_admin_actions = not self.show_full_result_count or bool(self.full_result_count)
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+    @property
+    def result_count_display(self):
+        if self.paginator.estimated:
+            return 'about {}'.format(self.result_count)
+        if self.paginator.capped:
+            return '{}+'.format(self.result_count)
+        return str(self.result_count)
+
+
+class LargeTableAdminMixin(ModelAdmin):
+    """A ModelAdmin mixin for changelists over large tables. Uses LargeTablePaginator, with
+    estimated counts unless the changelist is filtered or searched, and doesn't count the
+    unfiltered total. Pages are read by seeking on the ordering key (see LargeTableChangeList).
+    """
+    paginator = LargeTablePaginator
+    show_full_result_count = False
+    # Query parameters which don't filter the changelist results.
+    unfiltered_params = (PAGE_VAR, ORDER_VAR, ERROR_FLAG, IS_POPUP_VAR, TO_FIELD_VAR, AFTER_VAR, BEFORE_VAR)
+
+    def is_filtered(self, request):
+        return any(value for key, value in request.GET.items() if key not in self.unfiltered_params)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page, estimate=not self.is_filtered(request))
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
 
 
 def smart_truncate(content, length=100, suffix='...(more)'):
@@ -0,0 +1,16 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+from .cache import cache_stats
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class CacheStatsView(View):
+    """API endpoint to return API response cache statistics (hits, misses and hit rate) for each
+    cached view.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(cache_stats())